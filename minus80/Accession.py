@@ -3,12 +3,12 @@ import getpass
 import socket
 import urllib
 import asyncio
-import asyncssh
 import os
 
 from contextlib import contextmanager
 
 from .Config import cf
+from .SSHPool import SSHPool
 
 class Accession(object):
     '''
@@ -177,14 +177,13 @@ class Accession(object):
         asyncronously checks a URL
         based in its scheme
         '''
-        # Parse the URL and connect
+        # Parse the URL and run the check on a pooled connection
         url = urllib.parse.urlparse(url)
-        async with asyncssh.connect(
-                url.hostname,
-                username=url.username) as conn:
-            return await conn.run(
-                f'[[ -f {url.path} ]] && echo -n "Y" || echo -n "N"'
-            )
+        return await SSHPool.shared().run(
+            url.hostname,
+            f'[[ -f {url.path} ]] && echo -n "Y" || echo -n "N"',
+            username=url.username
+        )
 
 
     def _check_files(self): #pragma: no cover
@@ -201,16 +200,15 @@ class Accession(object):
         Returns True if all files are accessible, otherwise 
         returns a list of files that were unreachable.
         '''
-        # Set us up the loop
-        tasks = [] 
-        loop = asyncio.get_event_loop() 
-        # loop through the files and create tasks
         files = list(self.files)
-        for url in files:
-            tasks.append(self._check_file(url))
-        tasks = asyncio.gather(*tasks)
-        loop.run_until_complete(tasks)
-        unreachable = [i for i,r in enumerate(tasks.result()) if r.stdout != 'Y']
+        async def check_all():
+            return await asyncio.gather(*[
+                self._check_file(url) for url in files
+            ])
+        # asyncio.run closes the loop, and with it the pooled
+        # connections opened in it
+        results = asyncio.run(check_all())
+        unreachable = [i for i,r in enumerate(results) if r.stdout != 'Y']
         if len(unreachable) == 0:
             return True
         else:
@@ -0,0 +1,110 @@
+from collections import deque
+
+__all__ = ['Automaton']
+
+
+class Automaton(object):
+    '''
+        An Aho-Corasick automaton that finds every occurrence of a
+        set of patterns in a string in a single pass over it. Matching
+        is case insensitive.
+
+        >>> x = Automaton({'Sample1': 'Sample1', 'S1_alias': 'Sample1'})
+        >>> x.search('sample1_ATGTCA_L007_R1_001.fastq')
+        [('Sample1', 7)]
+    '''
+
+    def __init__(self, patterns):
+        '''
+        Build the automaton.
+
+        Parameters
+        ----------
+        patterns : dict
+            A mapping of pattern -> value. The value is reported
+            for each match of the pattern, e.g. the accession name
+            for an alias.
+        '''
+        # Each state is a dict of character -> next state
+        self._goto = [{}]
+        self._fail = [0]
+        # The (value, pattern length) pairs that end at each state
+        self._out = [[]]
+        for pattern, value in patterns.items():
+            if len(pattern) == 0:
+                continue
+            state = 0
+            for char in pattern.casefold():
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._out[state].append((value, len(pattern)))
+        # Breadth first to set the failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                if self._fail[child] == child:
+                    self._fail[child] = 0
+                # Inherit the matches that are suffixes of this one
+                self._out[child] = self._out[child] + \
+                    self._out[self._fail[child]]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def search(self, text):
+        '''
+        Find the patterns that occur in text.
+
+        Parameters
+        ----------
+        text : str
+            The string to scan
+
+        Returns
+        -------
+        A list of (value, length) tuples, one per distinct value,
+        holding the length of the longest pattern matched for that
+        value. Sorted by length, longest first.
+        '''
+        goto, fail, out = self._goto, self._fail, self._out
+        found = {}
+        state = 0
+        for char in text.casefold():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for value, length in out[state]:
+                if length > found.get(value, 0):
+                    found[value] = length
+        return sorted(found.items(), key=lambda x: x[1], reverse=True)
+
+    def search_many(self, texts):
+        '''
+            Search each of texts, returns a list of search results
+        '''
+        return [self.search(text) for text in texts]
+
+
+# The automaton of a pool worker, set once by _init_worker so it is
+# not pickled with every chunk
+_worker_automaton = None
+
+
+def _init_worker(automaton):
+    global _worker_automaton
+    _worker_automaton = automaton
+
+
+def _search_chunk(texts):
+    # Module level so it can be sent to a process pool
+    return _worker_automaton.search_many(texts)
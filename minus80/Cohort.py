@@ -1,38 +1,334 @@
-from functools import lru_cache
-from collections import Counter,defaultdict,namedtuple
+from collections import Counter,defaultdict,namedtuple,OrderedDict
 
 from minus80 import Accession, Freezable
+from minus80.Freezable import lite
+from minus80.Query import Query
+from minus80.Automaton import Automaton, _init_worker, _search_chunk
+from minus80.SSHPool import SSHPool
+from minus80.HostScheduler import HostScheduler
 from difflib import SequenceMatcher
-from itertools import chain
+from itertools import chain, repeat, islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from tqdm import tqdm
 from pprint import pprint
 
 import numpy as np
 
 import numbers
-import click
+import hashlib
 import math
+import click
 import warnings
 import logging
-import asyncssh
 import urllib
 import asyncio
 import os
-import backoff
 import getpass
 import socket
 import inspect
+import shlex
+import time
+import threading
 
 __all__ = ['Cohort']
 
-def invalidates_AID_cache(fn):
+def bumps_data_version(fn):
+    '''
+        Decorate methods that change accessions or metadata so
+        that caches derived from them (e.g. as_DataFrame) get rebuilt
+    '''
     from functools import wraps
     @wraps(fn)
     def wrapped(self,*args,**kwargs):
-        fn(self,*args,**kwargs) 
-        self._get_AID.cache_clear()
+        result = fn(self,*args,**kwargs)
+        self._bump_data_version()
+        return result
     return wrapped
 
+def _typed_value(val):
+    '''
+        Returns the (val, type) pair stored in the metadata table.
+        bools, ints and floats are stored natively by SQLite (bools
+        as 0/1) and anything else as its str.
+    '''
+    if isinstance(val, (bool, np.bool_)):
+        return int(val), 'bool'
+    if isinstance(val, numbers.Integral):
+        return int(val), 'int'
+    if isinstance(val, numbers.Real):
+        return float(val), 'float'
+    return str(val), 'str'
+
+def _stored_value(val, type):
+    '''
+        The inverse of _typed_value
+    '''
+    return bool(val) if type == 'bool' else val
+
+def _parse_text(val):
+    '''
+        Returns the (val, type) pair for a value that was stored as
+        text. Only values that convert back to exactly the same text
+        are parsed, so e.g. '001' stays a str.
+    '''
+    if val in ('True', 'False'):
+        return int(val == 'True'), 'bool'
+    try:
+        if str(int(val)) == val and -2**63 <= int(val) < 2**63:
+            return int(val), 'int'
+    except ValueError:
+        pass
+    try:
+        if str(float(val)) == val and math.isfinite(float(val)):
+            return float(val), 'float'
+    except ValueError:
+        pass
+    return val, 'str'
+
+def _kwarg_query(key, val):
+    '''
+        The Query for search_metadata(key=val). Before metadata was
+        typed every value was stored as text, so a str val also
+        matches the typed value it is migrated to by _parse_text,
+        e.g. age='25' matches 25 as it did before.
+    '''
+    if not isinstance(val, str):
+        return Query(key) == val
+    parsed, type = _parse_text(val)
+    if type == 'str':
+        return Query(key) == val
+    return Query(key)._leaf(
+        '(val = ? OR (val = ? AND type = ?))', val, parsed, type
+    )
+
+def _parse_text_column(col):
+    '''
+        _parse_text for a whole Series of str, with NaN for missing
+        values. Numbers are converted with pd.to_numeric and kept if
+        they convert back to the same text. Ints too large to be
+        exact as a float64 are left to _parse_text. A column of only
+        ints, floats or bools gets a nullable dtype, others are
+        returned as objects.
+    '''
+    import pandas as pd
+    text = col[col.notnull()].astype(object).to_numpy()
+    vals = text.copy()
+    is_bool = np.isin(text, ('True', 'False'))
+    vals[is_bool] = text[is_bool] == 'True'
+    nums = pd.to_numeric(
+        pd.Series(text), errors='coerce'
+    ).to_numpy(dtype='float64', na_value=np.nan)
+    is_number = np.isfinite(nums)
+    is_int = is_number & (np.abs(nums) < 2**53) & (nums == np.floor(nums))
+    ints = nums[is_int].astype('int64')
+    is_int[is_int] = ints.astype(str).astype(object) == text[is_int]
+    vals[is_int] = nums[is_int].astype('int64')
+    is_float = is_number & ~is_int
+    is_float[is_float] = nums[is_float].astype(str).astype(object) \
+        == text[is_float]
+    vals[is_float] = nums[is_float]
+    is_large = is_number & ~is_int & ~is_float & (np.abs(nums) >= 2**53)
+    vals[is_large] = [_stored_value(*_parse_text(x)) for x in text[is_large]]
+    if len(text) == 0:
+        dtype = object
+    elif is_bool.all():
+        dtype = 'boolean'
+    elif is_int.all():
+        dtype = 'Int64'
+    elif is_float.all():
+        dtype = 'Float64'
+    else:
+        dtype = object
+    vals = pd.Series(vals, index=col.index[col.notnull()], dtype=object)
+    return vals.astype(dtype).reindex(col.index)
+
+# Reads NUL separated paths, each prefixed by M (md5 and stat) or
+# S (stat only), and writes a NUL separated record of (path, canonical
+# path, "size mtime inode", md5) for each. Fields that could not be
+# found are empty.
+_FILEINFO_SCRIPT = r'''
+for f do
+    p=${f#?}
+    r=$(readlink -f -- "$p") || r=
+    s=$(stat -L -c '%s %Y %i' -- "$p" 2>/dev/null) || s=
+    m=
+    if [ "${f%"$p"}" = M ] && [ -n "$s" ]; then
+        m=$(md5sum < "$p" 2>/dev/null) && m=${m%% *} || m=
+    fi
+    printf '%s\0%s\0%s\0%s\0' "$p" "$r" "$s" "$m"
+done
+'''
+
+def _fileinfo_command(paths):
+    '''
+        Returns the (command, stdin) pair that gets the info of
+        paths, a list of (path, needs_md5) tuples, in one remote
+        command. xargs splits the paths into as few shells as the
+        argument limit allows.
+    '''
+    command = f'xargs -0 sh -c {shlex.quote(_FILEINFO_SCRIPT)} m80'
+    stdin = ''.join(
+        ('M' if md5 else 'S') + path + '\0' for path, md5 in paths
+    )
+    return command, stdin
+
+def _parse_fileinfo(output):
+    '''
+        Parse the output of _fileinfo_command into a dict of path ->
+        dict of canonical_path, size, mtime, inode and md5. Fields
+        that could not be found are None.
+    '''
+    fields = output.split('\0')
+    info = {}
+    for i in range(0, len(fields) - 3, 4):
+        path, canonical_path, stat, md5 = fields[i:i+4]
+        stat = stat.split()
+        if len(stat) != 3 or not all(x.isdigit() for x in stat):
+            stat = (None, None, None)
+        size, mtime, inode = [None if x is None else int(x) for x in stat]
+        info[path] = dict(
+            canonical_path=canonical_path or None,
+            size=size, mtime=mtime, inode=inode,
+            md5=md5 or None
+        )
+    return info
+
+@lru_cache(maxsize=None)
+def _local_hostnames():
+    # Lowercase like urlparse(url).hostname
+    return {
+        'localhost', '127.0.0.1', '::1',
+        socket.gethostname().lower(), socket.getfqdn().lower()
+    }
+
+def _is_local(url):
+    '''
+        True if url is a file:// url or is on this host as the
+        current user, so it can be read without SSH
+    '''
+    purl = urllib.parse.urlparse(url)
+    if purl.scheme == 'file':
+        return True
+    return purl.hostname in _local_hostnames() and \
+        purl.username in (None, getpass.getuser())
+
+def _local_stat(paths):
+    '''
+        The local equivalent of _fileinfo_command without md5s,
+        returns the same dict as _parse_fileinfo
+    '''
+    info = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            info[path] = dict(
+                canonical_path=None, size=None, mtime=None,
+                inode=None, md5=None
+            )
+            continue
+        info[path] = dict(
+            canonical_path=os.path.realpath(path), size=stat.st_size,
+            mtime=int(stat.st_mtime), inode=stat.st_ino, md5=None
+        )
+    return info
+
+def _local_md5(path, buffer_size=2**23):
+    '''
+        The md5 of a local file or None if it cannot be read. The
+        file is read into one large buffer; hashlib releases the GIL
+        while hashing it so files can be hashed in parallel threads.
+    '''
+    md5 = hashlib.md5()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            for n in iter(lambda: f.readinto(buffer), 0):
+                md5.update(view[:n])
+    except OSError:
+        return None
+    return md5.hexdigest()
+
+
+class AIDCache(object):
+    '''
+        A bounded mapping of accession names and aliases to AIDs.
+        Once maxsize entries are stored, the least recently used
+        entry is evicted. A reverse index of AID -> keys allows
+        dropping the entries of specific accessions. The cache
+        can be shared by threads.
+    '''
+
+    def __init__(self, maxsize=131072):
+        self.maxsize = maxsize
+        self._AIDs = OrderedDict()
+        self._keys = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._AIDs)
+
+    def __contains__(self, key):
+        return key in self._AIDs
+
+    def get(self, key):
+        '''
+            Return the AID for key or None if it is not cached
+        '''
+        with self._lock:
+            AID = self._AIDs.get(key)
+            if AID is not None:
+                self._AIDs.move_to_end(key)
+            return AID
+
+    def __setitem__(self, key, AID):
+        with self._lock:
+            self.discard([key])
+            self._AIDs[key] = AID
+            self._keys[AID].add(key)
+            while len(self._AIDs) > self.maxsize:
+                old_key, old_AID = self._AIDs.popitem(last=False)
+                self._discard_reverse(old_key, old_AID)
+
+    def update(self, items):
+        '''
+            Add an iterable of (key, AID) tuples
+        '''
+        for key, AID in items:
+            self[key] = AID
+
+    def discard(self, keys):
+        '''
+            Remove keys (names or aliases) from the cache
+        '''
+        with self._lock:
+            for key in keys:
+                AID = self._AIDs.pop(key, None)
+                if AID is not None:
+                    self._discard_reverse(key, AID)
+
+    def discard_AIDs(self, AIDs):
+        '''
+            Remove all of the keys mapping to AIDs from the cache
+        '''
+        with self._lock:
+            for AID in AIDs:
+                for key in self._keys.pop(AID, ()):
+                    del self._AIDs[key]
+
+    def clear(self):
+        with self._lock:
+            self._AIDs.clear()
+            self._keys.clear()
+
+    def _discard_reverse(self, key, AID):
+        keys = self._keys[AID]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self._keys[AID]
+
 
 class Cohort(Freezable):
     '''
@@ -44,13 +340,24 @@ class Cohort(Freezable):
     # This is a named tuple that will be populated by self.get_fileinfo
     fileinfo = None
 
+    # Set by _has_search_index the first time it is checked
+    _search_index = None
+
+    # The maximum number of names and aliases cached by _get_AID
+    _AID_cache_size = 131072
+
+    # The version of the table layout. Frozen Cohorts with an older
+    # version are upgraded by _upgrade_schema when they are loaded.
+    _schema_version = 4
+
     def __init__(self, name, parent=None):
         super().__init__(name,parent=parent)
         self.name = name
-        self._initialize_tables()
+        self._AID_cache = AIDCache(maxsize=self._AID_cache_size)
         self.log = logging.getLogger(f'minus80.Cohort.{name}')
         logging.basicConfig()
         self.log.setLevel(logging.INFO)
+        self._initialize_tables()
 
     #------------------------------------------------------#
     #                 Properties                           #
@@ -62,124 +369,272 @@ class Cohort(Freezable):
             Return a list of all the available metadata stored
             for available Accessions
         '''
-        return [ x[0] for x in self._db.cursor().execute('''
-            SELECT DISTINCT(key) FROM metadata;
-        ''').fetchall() ]
+        with self._read_cursor() as cur:
+            return [ x[0] for x in cur.execute('''
+                SELECT DISTINCT(key) FROM metadata;
+            ''').fetchall() ]
 
     @property
     def names(self):
         '''
             Return a list of all available names and aliases
         '''
-        names = [x[0] for x in self._db.cursor().execute(
-            'SELECT name FROM accessions'
-        )]
-        aliases = [x[0] for x in self._db.cursor().execute(
-            'SELECT alias FROM aliases'   
-        )]
+        with self._read_cursor() as cur:
+            names = [x[0] for x in cur.execute(
+                'SELECT name FROM accessions'
+            )]
+            aliases = [x[0] for x in cur.execute(
+                'SELECT alias FROM aliases'
+            )]
         return names + aliases
 
     @property
     def files(self):
-        return [x[0] for x in self._db.cursor().execute('''
-            SELECT url FROM raw_files WHERE ignore != 1
-        ''').fetchall() ]
+        with self._read_cursor() as cur:
+            return [x[0] for x in cur.execute('''
+                SELECT url FROM raw_files WHERE ignore != 1
+            ''').fetchall() ]
 
     @property
     def raw_files(self):
-        return [x[0] for x in self._db.cursor().execute('''
-            SELECT url FROM raw_files
-        ''').fetchall() ]
+        with self._read_cursor() as cur:
+            return [x[0] for x in cur.execute('''
+                SELECT url FROM raw_files
+            ''').fetchall() ]
 
     @property
     def unassigned_files(self):
-        assigned = set([x[0] for x in 
-            self._db.cursor().execute('''
-                SELECT DISTINCT(url) 
-                FROM files
-            ''').fetchall()
-        ])
+        with self._read_cursor() as cur:
+            assigned = set([x[0] for x in
+                cur.execute('''
+                    SELECT DISTINCT(url)
+                    FROM files
+                ''').fetchall()
+            ])
         return [x for x in self.files if x not in assigned]
 
     @property
     def ignored_files(self):
-        ignored = [x[0] for x in 
-            self._db.cursor().execute('''
-                SELECT DISTINCT(url) 
-                FROM raw_files WHERE ignore != 0
-            ''').fetchall()
-        ]
+        with self._read_cursor() as cur:
+            ignored = [x[0] for x in
+                cur.execute('''
+                    SELECT DISTINCT(url)
+                    FROM raw_files WHERE ignore != 0
+                ''').fetchall()
+            ]
         return ignored
 
-    @property
-    def _AID_mapping(self):
-        return {
-            x.name: x['AID']
-            for x in self
-        }
-
     @property
     def num_files(self):
         return len(self.files)
 
-    def as_DataFrame(self):
+    @property
+    def _data_version(self):
+        '''
+            A counter that is incremented each time accessions
+            or metadata are changed
+        '''
+        if 'data_version' in self._dict:
+            return self._dict['data_version']
+        return 0
+
+    def _bump_data_version(self):
+        self._dict['data_version'] = self._data_version + 1
+
+    def as_DataFrame(self, columns=None):
+        '''
+            Return the accession metadata as a wide DataFrame with
+            one row per accession and one column per metadata key.
+            The table is cached in the bcolz store and is only rebuilt
+            when the Cohort has changed since it was last built.
+
+            Parameters
+            ----------
+            columns : list of str (default: None)
+                Only read these metadata columns from the cache.
+                All columns are returned if None.
+
+            Returns
+            -------
+            A pandas.DataFrame indexed by accession name
+        '''
         try:
             import pandas as pd
         except ImportError as e:
             raise ImportError('Pandas must be installed to use this feature')
-        long_form = pd.DataFrame(self._db.cursor().execute('''
-            SELECT name,key,val FROM accessions acc 
-            JOIN metadata met on acc.AID = met.AID;
-        ''').fetchall(),columns=['name','key','val'])
-        return long_form.pivot(index='name',columns='key',values='val')
+        version = self._data_version
+        if 'metadata_wide_version' in self._dict \
+                and self._dict['metadata_wide_version'] == version:
+            try:
+                return self._bcolz('metadata_wide', columns=columns)
+            except (IOError, ImportError):
+                # The cached table went missing (or the bcolz stack is
+                # not usable), rebuild it below
+                pass
+        with self._read_cursor() as cur:
+            long_form = pd.DataFrame(cur.execute('''
+                SELECT name,key,val,type FROM accessions acc 
+                JOIN metadata met on acc.AID = met.AID;
+            ''').fetchall(),columns=['name','key','val','type'])
+            key_types = cur.execute('''
+                SELECT key, GROUP_CONCAT(DISTINCT type) FROM metadata
+                GROUP BY key
+            ''').fetchall()
+        # val is object so bools can be mixed into a numeric column
+        long_form['val'] = long_form['val'].astype(object)
+        is_bool = long_form['type'] == 'bool'
+        long_form.loc[is_bool,'val'] = long_form.loc[is_bool,'val'].astype(bool)
+        wide = long_form.pivot(index='name',columns='key',values='val')
+        # Values are stored typed, so columns holding a single type
+        # are converted without parsing
+        for key, types in key_types:
+            col = wide[key]
+            if types in ('int', 'bool') and not col.isnull().any():
+                wide[key] = col.astype('int64' if types == 'int' else 'bool')
+            elif types in ('int', 'float', 'int,float', 'float,int'):
+                wide[key] = col.astype('float64')
+        try:
+            self._bcolz('metadata_wide', df=wide)
+            self._dict['metadata_wide_version'] = version
+        except ImportError:
+            # Without the bcolz stack the table is not cached
+            pass
+        if columns is not None:
+            wide = wide[columns]
+        return wide
 
     #------------------------------------------------------#
     #                   Methods                            #
     #------------------------------------------------------#
 
-    def random_accession(self):
+    def random_accession(self, seed=None):
         '''
             Returns a random accession from the Cohort
 
             Parameters
             ----------
-            None
+            seed : int (default: None)
+                Seed for the random number generator
 
             Returns
             -------
             Accession
                 An Accession object
         '''
-        name = self._db.cursor().execute('''
-            SELECT name from accessions ORDER BY RANDOM() LIMIT 1;
-        ''').fetchone()[0]
-        return self[name]
+        return next(self.random_accessions(n=1, seed=seed))
 
-    def random_accessions(self, n=1, replace=False):
+    def random_accessions(self, n=1, replace=False, seed=None,
+                          stratify=None, batch_size=5000):
         '''
-            Returns a list of random accessions from the Cohort, either
-            with or without replacement.
+            Returns random accessions from the Cohort, either
+            with or without replacement. AIDs are sampled without
+            sorting the accessions table and the sampled accessions
+            are materialized in batches.
 
             Parameters
             ----------
             n : int
-                The number of random accessions to retrieve
+                The number of random accessions to retrieve. If
+                stratify is set, this is the number per stratum.
             replace: bool
                 If false, randomimzation does not include replacement
+            seed : int (default: None)
+                Seed for the random number generator, the same seed
+                gives the same sample from an unchanged Cohort
+            stratify : str (default: None)
+                A metadata key. If provided, n accessions are drawn
+                for each of its distinct values.
+            batch_size : int (default: 5000)
+                The number of accessions materialized at a time
+
+            Returns
+            -------
+            A generator of Accessions
+        '''
+        AIDs = self._sample_AIDs(
+            n, replace=replace, seed=seed, stratify=stratify
+        )
+        return self._iter_accessions_from_AIDs(AIDs, batch_size)
+
+    def iter_accessions(self, batch_size=5000):
+        '''
+            Iterate over all the Accessions in the Cohort in AID order.
+            Accessions are materialized in batches, each batch costing
+            a fixed number of queries regardless of its size.
+
+            Parameters
+            ----------
+            batch_size : int (default: 5000)
+                The number of accessions to fetch from the
+                database at a time.
+
+            Yields
+            ------
+            Accession
+                An Accession object
         '''
-        if replace is False:
-            if n > len(self):
-                raise ValueError(
-                        f'Only {len(self)} accessions in cohort. Cannot'
-                        ' get {n} samples. See replace parameter in help.'
+        last_AID = 0
+        while True:
+            # No transaction is held open while the batch is consumed
+            with self._read_cursor() as cur:
+                rows = cur.execute('''
+                    SELECT AID, name FROM accessions
+                    WHERE AID > ? ORDER BY AID LIMIT ?
+                ''', (last_AID, batch_size)).fetchall()
+                if len(rows) == 0:
+                    break
+                first_AID, last_AID = rows[0][0], rows[-1][0]
+                batch = self._build_accessions(
+                    rows, 'AID BETWEEN ? AND ?', (first_AID, last_AID)
                 )
-            return (
-                self[name] for (name, ) in self._db.cursor().execute('''
-                    SELECT name from accessions ORDER BY RANDOM() LIMIT ?;
-                ''', (n, ))
+            yield from batch
+
+    def get_many(self, names, return_missing=False):
+        '''
+            Retrieve many accessions at once. Names are resolved
+            in bulk and accessions are materialized with a fixed
+            number of queries regardless of how many are requested.
+
+            Parameters
+            ----------
+            names : iterable
+                Names, aliases, AIDs or Accession objects
+            return_missing : bool (default: False)
+                If True, also return the names that could not
+                be found in the Cohort.
+
+            Returns
+            -------
+            A list of Accessions in the same order as names. Names that
+            are not in the Cohort are skipped (and logged) rather than
+            raising a NameError. If return_missing is True, a tuple of
+            (accessions, missing) is returned.
+        '''
+        names = [x.name if isinstance(x, Accession) else x for x in names]
+        with self._read_cursor() as cur:
+            self._resolve_names(cur, names)
+            rows = cur.execute('''
+                SELECT lookup.name, acc.AID, acc.name
+                FROM temp.m80_lookup lookup
+                LEFT JOIN accessions acc ON acc.AID = lookup.AID
+                ORDER BY lookup.idx
+            ''').fetchall()
+            missing = [name for name, AID, _ in rows if AID is None]
+            self._AID_cache.update(
+                (name, AID) for name, AID, _ in rows
+                if AID is not None and isinstance(name, str)
             )
-        else:
-            return (self.random_accession() for _ in range(n))
+            accessions = self._build_accessions(
+                [(AID, name) for _, AID, name in rows if AID is not None],
+                'AID IN (SELECT AID FROM temp.m80_lookup)'
+            )
+        if len(missing) > 0:
+            self.log.warning(
+                f'{len(missing)} of {len(names)} names not in Cohort'
+            )
+        if return_missing:
+            return accessions, missing
+        return accessions
 
     def get_fileinfo(self, url):
         '''
@@ -195,15 +650,16 @@ class Cohort(Freezable):
         A named tuple contianing the url info.
 
         '''
-        if self.fileinfo is None:
-            # create a named tuple
-            cols = [x[0] for x in self._db.cursor().execute('SELECT * FROM raw_files').description]
-            self.fileinfo = namedtuple('fileinfo',cols)
-
-        info = self._db.cursor().execute('''
-            SELECT *
-            FROM raw_files WHERE url = ?
-        ''',(url,)).fetchone()
+        with self._read_cursor() as cur:
+            if self.fileinfo is None:
+                # create a named tuple
+                cols = [x[0] for x in cur.execute('SELECT * FROM raw_files').description]
+                self.fileinfo = namedtuple('fileinfo',cols)
+
+            info = cur.execute('''
+                SELECT *
+                FROM raw_files WHERE url = ?
+            ''',(url,)).fetchone()
         return self.fileinfo(*info)
 
     def update_fileinfo(self,info):
@@ -214,38 +670,112 @@ class Cohort(Freezable):
         if isinstance(info,self.fileinfo):
             info = [info]
         for x in info:
-            url = x.url
-            info_list.append(
-                (x.ignore, x.canonical_path, x.md5, x.size, x.url)    
-            )		
-        # Update the info 
-        self._db.cursor().executemany('''
-            UPDATE raw_files SET
-                ignore = ?,
-                canonical_path = ?,
-                md5 = ?,
-                size = ?
-            WHERE
-                url = ?
-        ''',info_list)
-
-    def add_accessions(self, accessions):
-        '''
-            Add multiple Accessions at once
+            info_list.append((
+                x.ignore, x.canonical_path, x.md5, x.size,
+                x.mtime, x.inode, x.stale, x.url
+            ))
+        # Update the info. Hashes can take hours to calculate so they
+        # are synced to disk rather than using the fast default.
+        with self._bulk_transaction(profile='durable') as cur:
+            cur.executemany('''
+                UPDATE raw_files SET
+                    ignore = ?,
+                    canonical_path = ?,
+                    md5 = ?,
+                    size = ?,
+                    mtime = ?,
+                    inode = ?,
+                    stale = ?
+                WHERE
+                    url = ?
+            ''',info_list)
+
+    def add_accessions(self, accessions, chunksize=10000,
+                       return_accessions=True, upsert=False):
+        '''
+            Add multiple Accessions at once. Accessions are consumed
+            from the iterable and committed chunksize at a time, so
+            generators of any length can be added in bounded memory.
+
+            Parameters
+            ----------
+            accessions : iterable of Accessions
+                The accessions to add
+            chunksize : int (default: 10000)
+                The number of accessions committed per transaction
+            return_accessions : bool (default: True)
+                If True, the added accessions are read back from the
+                database and returned. Otherwise the number of
+                accessions added is returned.
+            upsert : bool (default: False)
+                If True, the incoming accessions replace the stored
+                ones: they are diffed against the database and only
+                the metadata and files that changed are written.
+                Metadata keys and files that are no longer listed
+                on an accession are removed.
+
+            Returns
+            -------
+            A list of Accessions or the number of accessions added.
+            With upsert, a Counter summarizing the changes: the number
+            of accessions added, updated and unchanged as well as
+            the number of metadata rows and files added and removed.
+        '''
+        AIDs = []
+        num_added = 0
+        summary = Counter()
+        accessions = iter(accessions)
+        while True:
+            chunk = list(islice(accessions, chunksize))
+            if len(chunk) == 0:
+                break
+            if upsert:
+                changes = self._upsert_accession_chunk(chunk)
+                if changes['added'] or changes['updated']:
+                    # Bumped per chunk, the chunks before one that
+                    # raises are kept
+                    self._bump_data_version()
+                summary.update(changes)
+                continue
+            chunk_AIDs = self._add_accession_chunk(chunk)
+            num_added += len(chunk)
+            if return_accessions:
+                AIDs.extend(chunk_AIDs)
+        if upsert:
+            return summary
+        if return_accessions:
+            return list(self._iter_accessions_from_AIDs(AIDs, chunksize))
+        return num_added
+
+    def _add_accession_chunk(self, accessions):
+        '''
+            Insert a list of accessions in one transaction, only
+            the AIDs of these accessions are looked up.
+
+            Returns
+            -------
+            A list of the AIDs of accessions
         '''
         with self._bulk_transaction() as cur:
             # When a name is added, it is automatically assigned an ID
             cur.executemany('''
                 INSERT OR IGNORE INTO accessions (name) VALUES (?)
             ''', [(x.name, ) for x in accessions])
-            # Fetch that ID
-            AID_map = self._AID_mapping
+            # Fetch those IDs
+            self._reset_lookup(cur)
+            cur.executemany('''
+                INSERT INTO temp.m80_lookup (name) VALUES (?)
+            ''', [(x.name, ) for x in accessions])
+            AID_map = dict(cur.execute('''
+                SELECT acc.name, acc.AID FROM temp.m80_lookup lookup
+                JOIN accessions acc ON acc.name = lookup.name
+            '''))
             # Populate the metadata and files tables
             cur.executemany('''
-                INSERT OR REPLACE INTO metadata (AID, key, val)
-                VALUES (?, ?, ?)
+                INSERT OR REPLACE INTO metadata (AID, key, val, type)
+                VALUES (?, ?, ?, ?)
             ''', (
-                    (AID_map[accession.name], k, v)
+                    (AID_map[accession.name], k, *_typed_value(v))
                     for accession in accessions
                     for k, v in accession.metadata.items()
                 )
@@ -258,8 +788,132 @@ class Cohort(Freezable):
                     for file in accession.files
                 )
             )
-        return [self[x] for x in accessions]
+        self._AID_cache.update(AID_map.items())
+        # Bumped per chunk, the chunks before one that raises are kept
+        self._bump_data_version()
+        return [AID_map[x.name] for x in accessions]
+
+    def _upsert_accession_chunk(self, accessions):
+        '''
+            Diff a list of accessions against the database in one
+            transaction and write only the rows that changed. The
+            incoming metadata and files are staged in temp tables
+            so the diff is a pair of anti-joins in each direction.
 
+            Returns
+            -------
+            A Counter summarizing the changes
+        '''
+        summary = Counter()
+        # The last accession with a name replaces the others
+        accessions = list({x.name: x for x in accessions}.values())
+        names = [(x.name, ) for x in accessions]
+        with self._bulk_transaction() as cur:
+            self._reset_lookup(cur)
+            cur.executemany('''
+                INSERT INTO temp.m80_lookup (name) VALUES (?)
+            ''', names)
+            existing = set(name for (name, ) in cur.execute('''
+                SELECT acc.name FROM temp.m80_lookup lookup
+                JOIN accessions acc ON acc.name = lookup.name
+            '''))
+            new = set(x.name for x in accessions) - existing
+            cur.executemany('''
+                INSERT OR IGNORE INTO accessions (name) VALUES (?)
+            ''', ((name, ) for name in new))
+            cur.execute('''
+                UPDATE temp.m80_lookup SET AID = (
+                    SELECT AID FROM accessions
+                    WHERE accessions.name = m80_lookup.name
+                )
+            ''')
+            AID_map = dict(cur.execute('''
+                SELECT name, AID FROM temp.m80_lookup
+            '''))
+            # Stage the incoming rows
+            self._reset_staging(cur)
+            cur.executemany('''
+                INSERT INTO temp.m80_metadata (AID, key, val, type)
+                VALUES (?, ?, ?, ?)
+            ''', (
+                    (AID_map[accession.name], k, *_typed_value(v))
+                    for accession in accessions
+                    for k, v in accession.metadata.items()
+                )
+            )
+            cur.executemany('''
+                INSERT INTO temp.m80_files (AID, url) VALUES (?, ?)
+            ''', (
+                    (AID_map[accession.name], file)
+                    for accession in accessions
+                    for file in accession.files
+                )
+            )
+            # Stored rows that are not incoming
+            stale_metadata = cur.execute('''
+                SELECT m.rowid, m.AID
+                FROM (SELECT DISTINCT AID FROM temp.m80_lookup) lookup
+                CROSS JOIN metadata m ON m.AID = lookup.AID
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM temp.m80_metadata i
+                    WHERE i.AID = m.AID AND i.key = m.key
+                    AND i.val = m.val AND i.type = m.type
+                )
+            ''').fetchall()
+            stale_files = cur.execute('''
+                SELECT af.rowid, af.AID
+                FROM (SELECT DISTINCT AID FROM temp.m80_lookup) lookup
+                JOIN aid_files af ON af.AID = lookup.AID
+                JOIN raw_files rf ON rf.FID = af.FID
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM temp.m80_files i
+                    WHERE i.AID = af.AID AND i.url = rf.url
+                )
+            ''').fetchall()
+            # Incoming rows that are not stored
+            new_metadata = cur.execute('''
+                SELECT DISTINCT AID, key, val, type FROM temp.m80_metadata i
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM metadata m
+                    WHERE m.AID = i.AID AND m.key = i.key
+                    AND m.val = i.val AND m.type = i.type
+                )
+            ''').fetchall()
+            new_files = cur.execute('''
+                SELECT DISTINCT AID, url FROM temp.m80_files i
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM files f
+                    WHERE f.AID = i.AID AND f.url = i.url
+                )
+            ''').fetchall()
+            cur.executemany('''
+                DELETE FROM metadata WHERE rowid = ?
+            ''', ((rowid, ) for rowid, _ in stale_metadata))
+            cur.executemany('''
+                DELETE FROM aid_files WHERE rowid = ?
+            ''', ((rowid, ) for rowid, _ in stale_files))
+            # A value can change type but not val (e.g. 1 to True)
+            cur.executemany('''
+                INSERT OR REPLACE INTO metadata (AID, key, val, type)
+                VALUES (?, ?, ?, ?)
+            ''', new_metadata)
+            cur.executemany('''
+                INSERT INTO files (AID, url) VALUES (?, ?)
+            ''', new_files)
+        self._AID_cache.update(AID_map.items())
+        changed = set(AID for _, AID in chain(stale_metadata, stale_files))
+        changed.update(row[0] for row in chain(new_metadata, new_files))
+        new_AIDs = set(AID_map[name] for name in new)
+        summary['added'] = len(new_AIDs)
+        summary['updated'] = len(changed - new_AIDs)
+        summary['unchanged'] = len(set(AID_map.values()) - changed - new_AIDs)
+        summary['metadata_added'] = len(new_metadata)
+        summary['metadata_removed'] = len(stale_metadata)
+        summary['files_added'] = len(new_files)
+        summary['files_removed'] = len(stale_files)
+        return summary
+
+    @bumps_data_version
     def add_accession(self, accession):
         '''
             Add a sample to the Database
@@ -273,9 +927,10 @@ class Cohort(Freezable):
             AID = self._get_AID(accession)
             # Populate the metadata and files tables
             cur.executemany('''
-                INSERT OR REPLACE INTO metadata (AID, key, val)
-                VALUES (?, ?, ?)
-            ''', ((AID, k, v) for k, v in accession.metadata.items())
+                INSERT OR REPLACE INTO metadata (AID, key, val, type)
+                VALUES (?, ?, ?, ?)
+            ''', ((AID, k, *_typed_value(v))
+                  for k, v in accession.metadata.items())
             )
             cur.executemany('''
                 INSERT OR IGNORE INTO files (AID,url) VALUES (?,?)
@@ -284,6 +939,7 @@ class Cohort(Freezable):
         return self[accession]
 
 
+    @bumps_data_version
     def add_accessions_from_data_frame(self,df,name_col):
         '''
             Add accessions from data frame. This assumes
@@ -317,54 +973,452 @@ class Cohort(Freezable):
         # filter out rows with NaN name_col values
         # The tilda operator is a boolean inversion
         df = df.loc[~df[name_col].isnull(),:]
-        accessions = []
-        # Iterate over the rows and create and accessions from each one
-        for i,row in df.iterrows():
-            d = dict(row)  
-            name = d[name_col]
-            del d[name_col]
-            # Get rid of missing data
-            for k,v in list(d.items()):
-                if isinstance(v,numbers.Number) and math.isnan(v): 
-                    del d[k]
+        names = df[name_col].astype(str)
+        # Convert to long form: one (AID, key, val, type) row per cell,
+        # dropping the missing data. Numeric and bool columns share
+        # one type, only object columns are typed cell by cell.
+        dtype_types = {'b': 'bool', 'i': 'int', 'u': 'int', 'f': 'float'}
+        def long_form(AID_map):
+            for key in df.columns:
+                if key == name_col:
+                    continue
+                col = df[key]
+                present = col.notnull()
+                AIDs = names[present].map(AID_map).tolist()
+                if col.dtype.kind in dtype_types:
+                    vals = col[present].tolist()
+                    types = repeat(dtype_types[col.dtype.kind])
                 else:
-                    d[k] = str(v)
-            accessions.append(Accession(name, files=None, **d))
-        self.add_accessions(accessions)
+                    vals, types = zip(*map(_typed_value, col[present])) \
+                        if present.any() else ((), ())
+                for AID, val, type in zip(AIDs, vals, types):
+                    yield AID, str(key), val, type
+        with self._bulk_transaction() as cur:
+            cur.executemany('''
+                INSERT OR IGNORE INTO accessions (name) VALUES (?)
+            ''', ((x,) for x in names.tolist()))
+            self._reset_lookup(cur)
+            cur.executemany('''
+                INSERT INTO temp.m80_lookup (name) VALUES (?)
+            ''', ((x,) for x in names.tolist()))
+            AID_map = dict(cur.execute('''
+                SELECT acc.name, acc.AID FROM temp.m80_lookup lookup
+                JOIN accessions acc ON acc.name = lookup.name
+            '''))
+            cur.executemany('''
+                INSERT OR REPLACE INTO metadata (AID, key, val, type)
+                VALUES (?, ?, ?, ?)
+            ''', long_form(AID_map))
+        self._AID_cache.update(AID_map.items())
+
+    def import_table(self, path, name_col, chunksize=50000, sep=None):
+        '''
+            Import a CSV, TSV or Parquet sample sheet into the Cohort.
+            The file is streamed chunksize rows at a time (Parquet files
+            one row group at a time) so memory use does not depend on
+            the size of the file. Each row is an Accession, see
+            add_accessions_from_data_frame.
+
+            Parameters
+            ----------
+            path : str
+                The path to the file. Files ending in .parquet or .pq
+                are read as Parquet, others as delimited text.
+            name_col : str
+                The column containing the accession names
+            chunksize : int (default: 50000)
+                The number of rows read at a time
+            sep : str (default: None)
+                The delimiter for text files. Defaults to a tab for
+                .tsv and .txt files and a comma otherwise.
+
+            Returns
+            -------
+            The number of rows imported
+        '''
+        try:
+            import pandas as pd
+        except ImportError as e:
+            raise ImportError('Pandas must be installed to use this feature')
+        base = path[:-3] if path.endswith('.gz') else path
+        if base.endswith(('.parquet', '.pq')):
+            try:
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise ImportError(
+                    'pyarrow must be installed to import Parquet files'
+                )
+            parquet = pq.ParquetFile(path)
+            # Without integer_object_nulls, an int column is converted
+            # to float in the row groups that contain a null
+            chunks = (
+                parquet.read_row_group(i).to_pandas(integer_object_nulls=True)
+                for i in range(parquet.num_row_groups)
+            )
+        else:
+            if sep is None:
+                sep = '\t' if base.endswith(('.tsv', '.txt')) else ','
+            # Every column is read as str and parsed like _parse_text
+            # so the types do not depend on which rows share a chunk
+            # (e.g. an int column with a NaN in one chunk)
+            chunks = (
+                chunk.apply(
+                    lambda col: col if col.name == name_col \
+                        else _parse_text_column(col)
+                )
+                for chunk in pd.read_csv(
+                    path, sep=sep, chunksize=chunksize, dtype=str
+                )
+            )
+        num_rows = 0
+        start = time.time()
+        with tqdm(unit=' rows', desc=f'Importing {os.path.basename(path)}') as pbar:
+            for chunk in chunks:
+                self.add_accessions_from_data_frame(chunk, name_col)
+                num_rows += len(chunk)
+                pbar.update(len(chunk))
+        elapsed = time.time() - start
+        self.log.info(
+            f'Imported {num_rows} rows in {elapsed:.1f}s '
+            f'({num_rows/max(elapsed, 1e-9):.0f} rows/s)'
+        )
+        return num_rows
 
     
-    def alias_column(self, colname,min_alias_length=3):
-        '''
-            Assign an accession column as aliases
-        '''
-        cur_names = set(self.names)
-        with self._bulk_transaction() as cur: 
-            alias_dict = {a:aid for a,aid in cur.execute('''
-                SELECT val,AID FROM metadata 
-                WHERE key = ?
-            ''',(colname,)).fetchall()}
-            # We only want unique aliases
-            unique_aliases = []
-            alias_counts = Counter([x for x in alias_dict.keys()]) 
-            for alias,count in alias_counts.items():
-                if count > 1 or alias in cur_names:
-                    self.log.warning(f"Cannot use {alias} as it is not unique")
-                elif len(alias) < min_alias_length:
-                    self.log.warning(f"Skipping {alias} as it is too short (<{min_alias_length})")
-                else:
-                    unique_aliases.append((alias,alias_dict[alias]))
+    def alias_column(self, colname, min_alias_length=3):
+        '''
+            Assign the values of one or more metadata columns as
+            aliases of their accessions. A value is only used if it
+            belongs to a single accession across all of the columns,
+            is not the name of an accession or an existing alias and
+            has at least min_alias_length characters.
+
+            Parameters
+            ----------
+            colname : str or list of str
+                The metadata key(s) holding the aliases
+            min_alias_length : int (default: 3)
+                Shorter values are skipped
+
+            Returns
+            -------
+            A Counter with the number of distinct values that were
+            added as aliases and those that were rejected because
+            they were not_unique, too_short, a name or already an
+            (existing) alias.
+        '''
+        colnames = [colname] if isinstance(colname, str) else list(colname)
+        placeholders = ', '.join('?' for _ in colnames)
+        with self._bulk_transaction() as cur:
+            cur.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS m80_aliases (
+                    alias TEXT PRIMARY KEY,
+                    AID INTEGER,
+                    status TEXT
+                );
+                DELETE FROM temp.m80_aliases;
+            ''')
+            cur.execute(f'''
+                INSERT INTO temp.m80_aliases (alias, AID, status)
+                SELECT c.alias, c.AID, CASE
+                    WHEN c.num > 1 THEN 'not_unique'
+                    WHEN LENGTH(c.alias) < ? THEN 'too_short'
+                    WHEN EXISTS (
+                        SELECT 1 FROM accessions acc WHERE acc.name = c.alias
+                    ) THEN 'name'
+                    WHEN EXISTS (
+                        SELECT 1 FROM aliases a WHERE a.alias = c.alias
+                    ) THEN 'existing'
+                    ELSE 'added'
+                END
+                FROM (
+                    SELECT CAST(val AS TEXT) AS alias, MIN(AID) AS AID,
+                        COUNT(DISTINCT AID) AS num
+                    FROM metadata WHERE key IN ({placeholders})
+                    GROUP BY CAST(val AS TEXT)
+                ) c
+            ''', (min_alias_length, *colnames))
+            cur.execute('''
+                INSERT INTO aliases (alias, AID)
+                SELECT alias, AID FROM temp.m80_aliases
+                WHERE status = 'added'
+            ''')
+            counts = Counter(dict(cur.execute('''
+                SELECT status, COUNT(*) FROM temp.m80_aliases
+                GROUP BY status
+            ''')))
+            self._AID_cache.update(cur.execute('''
+                SELECT alias, AID FROM temp.m80_aliases
+                WHERE status = 'added'
+                LIMIT ?
+            ''', (self._AID_cache.maxsize, )))
+        self.log.info(
+            f'Added {counts["added"]} aliases from {", ".join(colnames)}, '
+            f'rejected {sum(counts.values()) - counts["added"]}'
+        )
+        return counts
+
+    def remove_accessions(self, accessions, prune_files=False):
+        '''
+            Remove many accessions at once, along with their aliases,
+            metadata and files, using a fixed number of statements
+            in one transaction.
+
+            Parameters
+            ----------
+            accessions : iterable or Query
+                Names, aliases, AIDs or Accession objects to remove,
+                or a Query selecting the accessions to remove (see
+                search_metadata). Names that are not in the Cohort
+                are ignored.
+            prune_files : bool (default: False)
+                If True, also remove the raw files of the removed
+                accessions that are not assigned to any other accession
+
+            Returns
+            -------
+            The number of accessions removed
+        '''
+        return self._remove_AIDs(
+            self._select_AIDs(accessions), prune_files=prune_files
+        )
 
+    def _select_AIDs(self, accessions):
+        '''
+            Returns the distinct AIDs of an iterable of names, aliases,
+            AIDs or Accessions, or of the accessions matching a Query.
+            Names that are not in the Cohort are ignored.
+        '''
+        if isinstance(accessions, Query):
+            sql, params = accessions._compiled()
+            with self._read_cursor() as cur:
+                return [AID for (AID, ) in cur.execute(sql, params)]
+        names = [
+            x.name if isinstance(x, Accession) else x
+            for x in accessions
+        ]
+        with self._read_cursor() as cur:
+            self._resolve_names(cur, names)
+            return [AID for (AID, ) in cur.execute('''
+                SELECT DISTINCT AID FROM temp.m80_lookup
+                WHERE AID IS NOT NULL
+            ''')]
+
+    def _remove_AIDs(self, AIDs, prune_files=False):
+        '''
+            Delete a list of AIDs from every table, see remove_accessions
+        '''
+        with self._bulk_transaction() as cur:
+            cur.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS m80_remove (
+                    AID INTEGER PRIMARY KEY
+                );
+                CREATE TEMP TABLE IF NOT EXISTS m80_prune (
+                    FID INTEGER PRIMARY KEY
+                );
+                DELETE FROM temp.m80_remove;
+                DELETE FROM temp.m80_prune;
+            ''')
             cur.executemany('''
-                INSERT INTO aliases (alias,AID) VALUES (?,?)      
-            ''',unique_aliases)
+                INSERT OR IGNORE INTO temp.m80_remove (AID) VALUES (?)
+            ''', ((AID, ) for AID in AIDs))
+            if prune_files:
+                cur.execute('''
+                    INSERT OR IGNORE INTO temp.m80_prune (FID)
+                    SELECT af.FID FROM temp.m80_remove r
+                    JOIN aid_files af ON af.AID = r.AID
+                ''')
+            cur.execute('''
+                DELETE FROM metadata
+                    WHERE AID IN (SELECT AID FROM temp.m80_remove);
+                DELETE FROM aliases
+                    WHERE AID IN (SELECT AID FROM temp.m80_remove);
+                DELETE FROM aid_files
+                    WHERE AID IN (SELECT AID FROM temp.m80_remove);
+                DELETE FROM accessions
+                    WHERE AID IN (SELECT AID FROM temp.m80_remove);
+            ''')
+            num_removed = self._db.changes()
+            # Only the files no other accession is assigned to
+            cur.execute('''
+                DELETE FROM raw_files WHERE FID IN (
+                    SELECT p.FID FROM temp.m80_prune p
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM aid_files af WHERE af.FID = p.FID
+                    )
+                )
+            ''')
+        self._AID_cache.discard_AIDs(AIDs)
+        if num_removed > 0:
+            self._bump_data_version()
+        return num_removed
+
+    def subset(self, name, accessions):
+        '''
+            Create a new Cohort from some of the accessions in this
+            one. Rows are copied between the databases by SQLite,
+            see _copy_from.
+
+            Parameters
+            ----------
+            name : str
+                The name of the new Cohort. If it already exists,
+                the accessions are merged into it.
+            accessions : iterable or Query
+                Names, aliases, AIDs or Accessions, or a Query
+                selecting the accessions (see search_metadata)
+
+            Returns
+            -------
+            A Cohort object
+        '''
+        AIDs = self._select_AIDs(accessions)
+        cohort = self.__class__(name)
+        cohort._copy_from(self, AIDs)
+        return cohort
+
+    def copy(self, name):
+        '''
+            Copy this Cohort, including its files that are not
+            assigned to any accession, to a new Cohort called name.
+
+            Returns
+            -------
+            A Cohort object
+        '''
+        cohort = self.__class__(name)
+        cohort._copy_from(self)
+        return cohort
+
+    def _copy_from(self, source, AIDs=None):
+        '''
+            Copy accessions from another Cohort into this one with
+            INSERT ... SELECT statements against the ATTACHed source
+            database. Accessions are matched by name and files by url,
+            AIDs and FIDs are assigned by this Cohort.
+
+            Parameters
+            ----------
+            source : Cohort
+                The Cohort to copy from
+            AIDs : list of int (default: None)
+                The source AIDs to copy. All accessions and all
+                raw files are copied if None.
+        '''
+        if source._get_dbpath('db.sqlite') == self._get_dbpath('db.sqlite'):
+            raise ValueError('Cannot copy a Cohort into itself')
+        cur = self._db.cursor()
+        # ATTACH can not be run inside of a transaction
+        cur.execute(
+            "ATTACH DATABASE ? AS m80_source",
+            (source._get_dbpath('db.sqlite'), )
+        )
+        try:
+            with self._bulk_transaction() as cur:
+                cur.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS m80_copy (
+                        AID INTEGER PRIMARY KEY
+                    );
+                    CREATE TEMP TABLE IF NOT EXISTS m80_AID_map (
+                        source_AID INTEGER PRIMARY KEY,
+                        AID INTEGER
+                    );
+                    DELETE FROM temp.m80_copy;
+                    DELETE FROM temp.m80_AID_map;
+                ''')
+                if AIDs is None:
+                    cur.execute('''
+                        INSERT INTO temp.m80_copy (AID)
+                        SELECT AID FROM m80_source.accessions
+                    ''')
+                else:
+                    cur.executemany('''
+                        INSERT OR IGNORE INTO temp.m80_copy (AID) VALUES (?)
+                    ''', ((AID, ) for AID in AIDs))
+                # Accessions, mapping source AIDs to the AIDs here
+                cur.execute('''
+                    INSERT OR IGNORE INTO main.accessions (name)
+                    SELECT src.name FROM temp.m80_copy c
+                    JOIN m80_source.accessions src ON src.AID = c.AID
+                    ORDER BY src.AID;
+
+                    INSERT INTO temp.m80_AID_map (source_AID, AID)
+                    SELECT src.AID, acc.AID FROM temp.m80_copy c
+                    JOIN m80_source.accessions src ON src.AID = c.AID
+                    JOIN main.accessions acc ON acc.name = src.name;
+                ''')
+                # The copied keys replace those already here
+                cur.execute('''
+                    DELETE FROM main.metadata WHERE rowid IN (
+                        SELECT dest.rowid FROM temp.m80_AID_map map
+                        CROSS JOIN m80_source.metadata m
+                            ON m.AID = map.source_AID
+                        JOIN main.metadata dest
+                            ON dest.AID = map.AID AND dest.key = m.key
+                    );
+
+                    INSERT OR REPLACE INTO main.metadata (AID, key, val, type)
+                    SELECT map.AID, m.key, m.val, m.type
+                    FROM temp.m80_AID_map map
+                    CROSS JOIN m80_source.metadata m
+                        ON m.AID = map.source_AID;
+
+                    INSERT OR IGNORE INTO main.aliases (alias, AID)
+                    SELECT a.alias, map.AID FROM temp.m80_AID_map map
+                    JOIN m80_source.aliases a ON a.AID = map.source_AID;
+                ''')
+                # Raw files, with the file info columns both tables share
+                source_columns = set(
+                    col for (_, col, *_) in cur.execute(
+                        'PRAGMA m80_source.table_info(raw_files)'
+                    ).fetchall()
+                )
+                shared = [
+                    col for (_, col, *_) in cur.execute(
+                        'PRAGMA main.table_info(raw_files)'
+                    ).fetchall()
+                    if col != 'FID' and col in source_columns
+                ]
+                columns = ', '.join(shared)
+                src_columns = ', '.join(f'rf.{x}' for x in shared)
+                if AIDs is None:
+                    cur.execute(f'''
+                        INSERT OR IGNORE INTO main.raw_files ({columns})
+                        SELECT {src_columns} FROM m80_source.raw_files rf
+                        ORDER BY rf.FID
+                    ''')
+                else:
+                    cur.execute(f'''
+                        INSERT OR IGNORE INTO main.raw_files ({columns})
+                        SELECT {src_columns} FROM m80_source.raw_files rf
+                        WHERE rf.FID IN (
+                            SELECT af.FID FROM temp.m80_AID_map map
+                            JOIN m80_source.aid_files af
+                                ON af.AID = map.source_AID
+                        )
+                        ORDER BY rf.FID
+                    ''')
+                cur.execute('''
+                    INSERT OR IGNORE INTO main.aid_files (AID, FID)
+                    SELECT map.AID, rf.FID FROM temp.m80_AID_map map
+                    JOIN m80_source.aid_files af ON af.AID = map.source_AID
+                    JOIN m80_source.raw_files src ON src.FID = af.FID
+                    JOIN main.raw_files rf ON rf.url = src.url
+                ''')
+        finally:
+            self._db.cursor().execute('DETACH DATABASE m80_source')
+        self._bump_data_version()
 
-    @invalidates_AID_cache
     def drop_aliases(self):
         '''
             Clear the aliases from the database
         '''
-        self._db.cursor().execute('DELETE FROM aliases')
+        with self._bulk_transaction() as cur:
+            aliases = [x for (x,) in cur.execute('SELECT alias FROM aliases')]
+            cur.execute('DELETE FROM aliases')
+        self._AID_cache.discard(aliases)
 
+    @bumps_data_version
     def drop_accessions(self):
        with self._bulk_transaction() as cur:
             cur.execute('''
@@ -373,93 +1427,330 @@ class Cohort(Freezable):
                 DELETE FROM metadata;
                 DELETE FROM aid_files;
             ''')
+       self._AID_cache.clear()
 
-    def assimilate_files(self,files,best_only=True):
+    def assimilate_files(self,files,best_only=True,fuzzy=False,
+                         processes=None):
         '''
             Take a list of files and assign them to Accessions
+
+            Parameters
+            ----------
+            files : iterable of str
+                The files (paths or urls) to assign
+            best_only : bool (default: True)
+                Only assign each file to its best match
+            fuzzy : bool (default: False)
+                Files whose basename does not contain any accession
+                name or alias are matched with search_accessions
+                (longest common substring) instead of being unmatched
+            processes : int (default: None)
+                See match_files
+
+            Returns
+            -------
+            A dict of accession name -> set of files. Files that could
+            not be matched are under the 'unmatched' key.
         '''
         results = defaultdict(set)
-        for f in files:
-            matches = self.search_accessions(os.path.basename(f))
+        for f,matches in self.match_files(files,processes=processes).items():
+            if len(matches) == 0 and fuzzy:
+                matches = self.search_accessions(
+                    os.path.basename(f),include_scores=True
+                )
             if len(matches) == 0:
                 results['unmatched'].add(f)
             elif best_only:
-                results[matches[0]].add(f)
+                results[matches[0][0]].add(f)
             else:
-                for m in matches:
+                for m,score in matches:
                     results[m].add(f)
         return results
 
-    async def _info_worker(self, url_queue,pbar=None):
+    def match_files(self,files,processes=None,chunksize=10000):
+        '''
+            Find the accession names and aliases contained in the
+            basename of each file. All names and aliases are compiled
+            into a single Aho-Corasick automaton which scans each
+            basename in one pass.
+
+            Parameters
+            ----------
+            files : iterable of str
+                The files (paths or urls) to match
+            processes : int (default: None)
+                If more than 1, split the files into chunks of chunksize
+                and scan them in a pool of this many processes
+            chunksize : int (default: 10000)
+                The number of files sent to a process at a time
+
+            Returns
+            -------
+            A dict of file -> list of (accession name, score) tuples,
+            best first. The score is the percent of the basename
+            covered by the matched name or alias.
+        '''
+        with self._read_cursor() as cur:
+            patterns = {
+                name: name for (name,) in cur.execute(
+                    'SELECT name FROM accessions'
+                )
+            }
+            for alias,name in cur.execute('''
+                    SELECT alias, name FROM aliases
+                    JOIN accessions ON aliases.AID = accessions.AID
+                '''):
+                patterns.setdefault(alias,name)
+        automaton = Automaton(patterns)
+        files = list(files)
+        basenames = [os.path.basename(f) for f in files]
+        if processes is not None and processes > 1:
+            chunks = [
+                basenames[i:i+chunksize] 
+                for i in range(0,len(basenames),chunksize)
+            ]
+            with ProcessPoolExecutor(
+                    processes,initializer=_init_worker,
+                    initargs=(automaton,)) as pool:
+                found = list(chain.from_iterable(
+                    pool.map(_search_chunk,chunks)
+                ))
+        else:
+            found = automaton.search_many(basenames)
+        return {
+            f: [(name,int(100*length/len(base))) for name,length in matches]
+            for f,base,matches in zip(files,basenames,found)
+        }
+
+    async def _batch_fileinfo(self, urls, stat_only=False, rehash=False,
+                              executor=None):
         '''
-        Given a queue of URLs, this worker will calculate the md5 checksums
-        and commit them to the 'raw_files' database table
+        Get the canonical path, size, mtime, inode and md5 of urls,
+        which are all on the same host, with one remote command.
+        Local files (see _is_local) are read in process instead, on
+        the threads of executor (the default executor if None).
+
+        The md5 is only calculated for files without one, unless
+        rehash is True. The stored md5 belongs to the stored size,
+        mtime and inode: if any of those changed and the file was
+        not hashed again, or hashing it failed, the md5 is kept but
+        the file is flagged as stale. Files that are gone lose their
+        md5 and stat and are flagged as stale. A file whose stat
+        matches its md5 again is no longer stale.
+
+        Returns
+        -------
+        A list of fileinfo tuples
         '''
-        def backoff_hdlr(details):
-            print("Backing off {wait:0.1f} seconds afters {tries} tries "
-                "calling function {target} with args {args} and kwargs "
-                "{kwargs}".format(**details)
+        infos = [self.get_fileinfo(url) for url in urls]
+        purl = urllib.parse.urlparse(urls[0])
+        paths = [urllib.parse.urlparse(url).path for url in urls]
+        needs_md5 = [
+            (path, not stat_only and (rehash or info.md5 is None))
+            for path, info in zip(paths, infos)
+        ]
+        if _is_local(urls[0]):
+            loop = asyncio.get_event_loop()
+            found = await loop.run_in_executor(executor, _local_stat, paths)
+            hashed = [
+                path for path, md5 in needs_md5
+                if md5 and found[path]['size'] is not None
+            ]
+            md5s = await asyncio.gather(*[
+                loop.run_in_executor(executor, _local_md5, path)
+                for path in hashed
+            ])
+            for path, md5 in zip(hashed, md5s):
+                found[path]['md5'] = md5
+        else:
+            command, stdin = _fileinfo_command(needs_md5)
+            # The script exits 0 when it runs, otherwise the batch
+            # failed (e.g. no xargs) and asyncssh raises a ProcessError
+            result = await SSHPool.shared().run(
+                purl.hostname, command, username=purl.username,
+                input=stdin, check=True
             )
-        @backoff.on_exception(backoff.expo,asyncssh.DisconnectError,max_tries=8,
-                            on_backoff=backoff_hdlr)
-        async def get_info(url):
-            current_info = self.get_fileinfo(url)
-            purl = urllib.parse.urlparse(url)
-            async with asyncssh.connect(purl.hostname,username=purl.username) as conn:
-                if current_info.canonical_path is None:
-                    readlink = await conn.run(f'readlink -f {purl.path}',check=False)
-                    if readlink.exit_status == 0:
-                        readlink = readlink.stdout.strip()
-                        current_info = current_info._replace(canonical_path=readlink)
-                if current_info.md5 is None: 
-                    md5sum = await conn.run(f'md5sum {purl.path}',check=False)
-                    if md5sum.exit_status == 0:
-                        md5sum = md5sum.stdout.strip().split()[0]
-                        current_info = current_info._replace(md5=md5sum)
-                if current_info.size is None:
-                    size = await conn.run(f'stat -c "%s" {purl.path}',check=False)
-                    if size.exit_status == 0:
-                        size = int(size.stdout.strip())
-                        current_info = current_info._replace(size=size)
-            return current_info
-
-        results = [] 
-        # Define the coro here so we can decorate with a backoff
-        # while there is work to do, loop 
-        while not url_queue.empty():
-            url = await url_queue.get()
-            info = await get_info(url)
-            results.append(info)
-            url_queue.task_done()
-            if len(results) >= 50:
-                self.update_fileinfo(results)
-                pbar.update(len(results))
-                results = []
-        pbar.update(len(results))
-        self.update_fileinfo(results)
-
-    async def _calculate_fileinfo(self,files,max_tasks=7):
-        # Get a url  queue and fill it
-        url_queue = asyncio.Queue()
-        hosts = set()
-        for f in files:
-            url_queue.put_nowait(f)
-            hosts.add(urllib.parse.urlparse(f).hostname)  
-        self.log.info(f'There are {url_queue.qsize()} urls to process')
-        # Create a progress bar
-        with tqdm(total=url_queue.qsize()) as pbar:
-            # Get the event loop and control flow
-            tasks = []
-            for i in range(max_tasks):
-                task = asyncio.create_task(self._info_worker(url_queue,pbar=pbar))
-                await asyncio.sleep(3)
-                tasks.append(task)
-            await url_queue.join()
-        # cancel tasks
-        for task in tasks:
-            task.cancel()
-        # wait until all tasks cancel
-        await asyncio.gather(*tasks,return_exceptions=True)
+            found = _parse_fileinfo(result.stdout)
+            # Files without a record would be flagged as missing
+            missing = set(paths) - set(found)
+            if len(missing) > 0:
+                raise IOError(
+                    f'{purl.hostname} returned no file info for '
+                    f'{len(missing)} of {len(paths)} files'
+                )
+        updated = []
+        for (path, md5), info in zip(needs_md5, infos):
+            new = found.get(path, {})
+            canonical_path = new.get('canonical_path') or info.canonical_path
+            stat = dict(
+                size=new.get('size'), mtime=new.get('mtime'),
+                inode=new.get('inode')
+            )
+            if new.get('md5') is not None:
+                updated.append(info._replace(
+                    canonical_path=canonical_path, md5=new['md5'],
+                    stale=0, **stat
+                ))
+            elif stat['size'] is None:
+                # Missing or unreadable, the md5 belongs to a file
+                # that is gone
+                updated.append(info._replace(md5=None, stale=1, **stat))
+            elif md5 or any(
+                getattr(info, k) is not None and getattr(info, k) != v
+                for k, v in stat.items()
+            ):
+                # Changed, or the hash failed
+                updated.append(info._replace(
+                    canonical_path=canonical_path, stale=1
+                ))
+            else:
+                # Stale files whose stat matches their md5 again are not
+                stale = info.stale if info.md5 is None or any(
+                    getattr(info, k) is None for k in stat
+                ) else 0
+                updated.append(info._replace(
+                    canonical_path=canonical_path, stale=stale, **stat
+                ))
+        return updated
+
+    async def _calculate_fileinfo(self,files,max_tasks=16,max_per_host=4,
+                                  batch_size=500,batch_bytes=2**32,
+                                  progress=True,stat_only=False,
+                                  rehash=False,local_threads=None):
+        '''
+        Calculate the canonical path, size and md5 of files and store
+        them in the 'raw_files' table.
+
+        The files on each host are split into batches that read about
+        the same number of bytes (using sizes already in the table)
+        and each batch is done with one remote command. Hosts are
+        scheduled independently by a HostScheduler which adapts how
+        many batches run on each host to its throughput and errors.
+
+        Parameters
+        ----------
+        files : iterable of str
+            The urls of the files
+        max_tasks : int (default: 16)
+            The maximum number of batches running over all hosts
+        max_per_host : int (default: 4)
+            The maximum number of batches running on one host
+        batch_size : int (default: 500)
+            The maximum number of files in a batch
+        batch_bytes : int (default: 4GB)
+            A batch is closed once the files needing an md5 add
+            up to this many bytes
+        progress : bool (default: True)
+            Show a progress bar per host
+        stat_only : bool (default: False)
+            Only stat the files, no md5s are calculated
+        rehash : bool (default: False)
+            Calculate the md5 of every file, not only the ones
+            without one
+        local_threads : int (default: None)
+            The number of threads reading local files, which are
+            hashed in process rather than over SSH. Defaults to
+            the number of CPUs.
+
+        Returns
+        -------
+        A dict of host -> throughput stats, see HostScheduler.run
+        '''
+        by_host = defaultdict(list)
+        with self._read_cursor() as cur:
+            for f in files:
+                purl = urllib.parse.urlparse(f)
+                size, md5 = cur.execute(
+                    'SELECT size, md5 FROM raw_files WHERE url = ?', (f,)
+                ).fetchone()
+                # Only hashing reads the whole file
+                hashed = not stat_only and (rehash or md5 is None)
+                n_bytes = size if size is not None and hashed else 0
+                by_host[(purl.hostname, purl.username)].append((f, n_bytes))
+        batches = []
+        for (hostname, username), urls in by_host.items():
+            host = hostname if username is None else f'{username}@{hostname}'
+            batch, total = [], 0
+            for url, n_bytes in urls:
+                batch.append(url)
+                total += n_bytes
+                if len(batch) >= batch_size or total >= batch_bytes:
+                    batches.append((host, batch, total))
+                    batch, total = [], 0
+            if batch:
+                batches.append((host, batch, total))
+        self.log.info(
+            f'There are {sum(len(x) for x in by_host.values())} urls '
+            f'on {len(by_host)} hosts to process'
+        )
+
+        if local_threads is None:
+            local_threads = os.cpu_count() or 1
+        with ThreadPoolExecutor(local_threads) as executor:
+
+            async def calculate(urls):
+                self.update_fileinfo(await self._batch_fileinfo(
+                    urls, stat_only=stat_only, rehash=rehash,
+                    executor=executor
+                ))
+
+            scheduler = HostScheduler(
+                max_tasks=max_tasks, max_per_host=max_per_host,
+                progress=progress, log=self.log
+            )
+            return await scheduler.run(batches, calculate)
+
+    async def refresh_fileinfo(self,files=None,rehash=True,**kwargs):
+        '''
+        Check that the stored file info is still current. All files
+        are stat-ed in bulk and only the files whose size, mtime or
+        inode changed since they were hashed (or that were never
+        hashed) are read again.
+
+        Parameters
+        ----------
+        files : iterable of str (default: None)
+            The urls to check, all files that are not ignored if None
+        rehash : bool (default: True)
+            Hash the changed files. If False they are only flagged
+            as stale.
+        kwargs : dict
+            Passed on to _calculate_fileinfo (e.g. max_per_host)
+
+        Returns
+        -------
+        A Counter of the files checked, changed (hashed again) and
+        still stale (e.g. missing) afterwards
+        '''
+        files = set(self.files if files is None else files)
+        await self._calculate_fileinfo(files,stat_only=True,**kwargs)
+        # Missing files have no size and are not hashed again
+        with self._read_cursor() as cur:
+            md5s = {url: md5 for (url, md5) in cur.execute('''
+                SELECT url, md5 FROM raw_files
+                WHERE (stale = 1 OR md5 IS NULL) AND size IS NOT NULL
+            ''') if url in files}
+        changed = []
+        if rehash and len(md5s) > 0:
+            await self._calculate_fileinfo(list(md5s),rehash=True,**kwargs)
+            # Only the files whose md5 is different count as changed
+            with self._read_cursor() as cur:
+                changed = [url for url, md5 in md5s.items() if cur.execute(
+                    'SELECT md5 FROM raw_files WHERE url = ?', (url,)
+                ).fetchone()[0] != md5]
+        with self._read_cursor() as cur:
+            stale = sum(1 for (url,) in cur.execute(
+                'SELECT url FROM raw_files WHERE stale = 1'
+            ) if url in files)
+        summary = Counter(
+            checked=len(files),changed=len(changed),
+            stale=stale
+        )
+        self.log.info(
+            f'Checked {len(files)} files, {summary["changed"]} changed, '
+            f'{stale} stale'
+        )
+        return summary
 
     def interactive_ignore_pattern(self,pattern,n=20):
         '''
@@ -489,31 +1780,56 @@ class Cohort(Freezable):
 
     def search_files(self,url):
         '''
-            Perform a search of files names (url/path)
+            Perform a search of files names (url/path). Matches are
+            ranked by the trigram index when it is available.
         '''
-        cur = self._db.cursor()
-        name = f'%{url}%'
-        names = cur.execute(
-            'SELECT url FROM raw_files WHERE url LIKE ? and ignore != 1',(name,)        
-        ).fetchall()
+        match = self._search_index_match(url)
+        with self._read_cursor() as cur:
+            if match is not None:
+                names = cur.execute('''
+                    SELECT raw_files.url FROM raw_files_fts
+                    JOIN raw_files ON raw_files.FID = raw_files_fts.rowid
+                    WHERE raw_files_fts MATCH ? AND raw_files.ignore != 1
+                    ORDER BY raw_files_fts.rank
+                ''',(match,)).fetchall()
+            else:
+                name = f'%{url}%'
+                names = cur.execute(
+                    'SELECT url FROM raw_files WHERE url LIKE ? and ignore != 1',(name,)        
+                ).fetchall()
         return [x[0] for x in names]
 
     def search_accessions(self,name,include_scores=False,recurse=True):
         '''
-            Performs a search of accession names 
+            Performs a search of accession names and aliases. Matches
+            are ranked by the trigram index when it is available.
         '''
-        cur = self._db.cursor()
-        sql_name = f'%{name}%'
-        names = cur.execute(
-            'SELECT name FROM accessions WHERE name LIKE ?',(sql_name,)
-        ).fetchall()
-        aliases = cur.execute(
-            'SELECT alias FROM aliases WHERE alias LIKE ?',(sql_name,)
-        ).fetchall()
+        match = self._search_index_match(name)
+        with self._read_cursor() as cur:
+            if match is not None:
+                names = cur.execute('''
+                    SELECT name, rank FROM accessions_fts
+                    WHERE accessions_fts MATCH ?
+                    UNION ALL
+                    SELECT alias, rank FROM aliases_fts
+                    WHERE aliases_fts MATCH ?
+                    ORDER BY 2
+                ''',(match,match)).fetchall()
+                aliases = []
+            else:
+                sql_name = f'%{name}%'
+                names = cur.execute(
+                    'SELECT name FROM accessions WHERE name LIKE ?',(sql_name,)
+                ).fetchall()
+                aliases = cur.execute(
+                    'SELECT alias FROM aliases WHERE alias LIKE ?',(sql_name,)
+                ).fetchall()
         results = [(x[0],100) for x in names + aliases]
         # Find and Subset matches. e.g. Fat_shoulder_1 would
         # match 'M7956_Fat_shoulder_1'
-        if len(results) == 0 and recurse == True:
+        if len(results) == 0 and recurse == True and self._has_search_index:
+            results = self._longest_common_matches(name)
+        elif len(results) == 0 and recurse == True:
             matches = [
                 SequenceMatcher(None,name,x).find_longest_match(0,len(name),0,len(x)) \
                 for x in self.names
@@ -528,28 +1844,66 @@ class Cohort(Freezable):
             results = [x[0] for x in results]
         return results
 
-    def search_metadata(self,**kwargs):
-        '''
-        '''
-        n_crit = 0
-        criteria = []
-        for k,v in kwargs.items():
-            criteria.append(f"(key = '{k}' AND val = '{v}')")
-            n_crit += 1
-        criteria = " OR ".join(criteria)
-        # Build the query
-        query = f'''
-            SELECT AID FROM (
-                SELECT AID, COUNT(*) as count FROM metadata 
-                WHERE {criteria}
-                GROUP BY AID
-            )
-            WHERE count = {n_crit}
+    def search_metadata(self, *queries, returns='accessions',
+                        batch_size=5000, **kwargs):
         '''
-        return [self[x] for (x,) in \
-                self._db.cursor().execute(query).fetchall()
-        ]
-       
+            Search for accessions based on their metadata.
+
+            Parameters
+            ----------
+            *queries : minus80.Query
+                Any number of Query objects, which are ANDed together.
+                See minus80.Query for supported comparisons.
+            returns : str (default: 'accessions')
+                What to return for each match, one of:
+                'accessions' : a list of Accessions
+                'iter' : a generator of Accessions, materialized
+                         batch_size at a time
+                'names' : a list of accession names
+                'AIDs' : a list of AIDs
+            batch_size : int (default: 5000)
+                Batch size used when returns='iter'
+            **kwargs : key=value
+                Shorthand for Query(key) == value, except that str
+                values also match the typed value they parse to,
+                e.g. age='25' matches 25
+
+            Returns
+            -------
+            Matches in AID order, see the returns parameter
+
+            Example
+            -------
+            >>> from minus80 import Query as Q
+            >>> x.search_metadata(Q('age') > 30, type='WGS')
+        '''
+        criteria = list(queries) + [_kwarg_query(k, v) for k, v in kwargs.items()]
+        if len(criteria) == 0:
+            raise ValueError('Provide at least one Query or key=value')
+        query = criteria[0]
+        for criterion in criteria[1:]:
+            query = query & criterion
+        sql, params = query._compiled()
+        with self._read_cursor() as cur:
+            if returns == 'names':
+                return [name for (name, ) in cur.execute(f'''
+                    SELECT name FROM accessions WHERE AID IN ({sql})
+                    ORDER BY AID
+                ''', params)]
+            AIDs = [AID for (AID, ) in cur.execute(f'''
+                SELECT AID FROM ({sql}) ORDER BY AID
+            ''', params)]
+        if returns == 'AIDs':
+            return AIDs
+        elif returns == 'accessions':
+            return self._accessions_from_AIDs(AIDs)
+        elif returns == 'iter':
+            return self._iter_accessions_from_AIDs(AIDs, batch_size)
+        else:
+            raise ValueError(
+                'returns must be one of accessions, iter, names or AIDs'
+            )
+
     async def crawl_host(self,hostname='localhost',path='/',
                          username=None,glob='*.fastq'):
         '''
@@ -558,8 +1912,9 @@ class Cohort(Freezable):
         if username is None:
             username = getpass.getuser()
         find_command = f'find -L {path} ! -readable -prune -o -name "{glob}" '
-        async with asyncssh.connect(hostname,username=username) as conn:
-            result = await conn.run(find_command,check=False)
+        result = await SSHPool.shared().run(
+            hostname, find_command, username=username, check=False
+        )
         if result.exit_status == 0:
             files = result.stdout.split("\n")
         else:
@@ -610,19 +1965,13 @@ class Cohort(Freezable):
             f'\tcontains {len(self)} Accessions\n'
             f'\t{len(self.files)} files ({len(self.unassigned_files)} unassigned)')
 
-    @invalidates_AID_cache
     def __delitem__(self, name):
         '''
             Remove a sample by name (or by composition)
         '''
-        # First try
+        # Raises a NameError if the accession does not exist
         AID = self._get_AID(name)
-
-        self._db.cursor().execute('''
-            DELETE FROM accessions WHERE AID = ?;
-            DELETE FROM metadata WHERE AID = ?;
-            DELETE FROM aid_files WHERE AID = ?;
-        ''', (AID, AID, AID))
+        self._remove_AIDs([AID])
 
     def __getitem__(self, name):
         '''
@@ -633,36 +1982,37 @@ class Cohort(Freezable):
             name : object
                 Can be a string, i.e. the name or alias of an Accession,
                 it can be an Actual Accession OR the AID which
-                is an internal ID for accession
+                is an internal ID for accession. A list of any of
+                these will return a list of Accessions (see get_many).
         '''
+        if isinstance(name, list):
+            return self.get_many(name)
         AID = self._get_AID(name)
-        cur = self._db.cursor()
-        # Get the name based on AID
-        name, = cur.execute('SELECT name FROM accessions WHERE AID = ?',(AID,)).fetchone() 
-        metadata = {
-            k: v for k, v in cur.execute('''
-                SELECT key, val FROM metadata WHERE AID = ?;
+        with self._read_cursor() as cur:
+            # Get the name based on AID
+            name, = cur.execute('SELECT name FROM accessions WHERE AID = ?',(AID,)).fetchall()[0]
+            metadata = {
+                k: _stored_value(v, t) for k, v, t in cur.execute('''
+                    SELECT key, val, type FROM metadata WHERE AID = ?;
+                    ''', (AID, )
+                ).fetchall()
+            }
+            metadata['AID'] = AID
+            files = [x[0] for x in cur.execute('''
+                    SELECT url FROM files WHERE AID = ?;
                 ''', (AID, )
-            ).fetchall()
-        }
-        metadata['AID'] = AID
-        files = [x[0] for x in cur.execute('''
-                SELECT url FROM files WHERE AID = ?;
-            ''', (AID, )
-            ).fetchall()
-        ]
+                ).fetchall()
+            ]
         return Accession(name, files=files, **metadata)
 
     def __len__(self):
-        return self._db.cursor().execute('''
-            SELECT COUNT(*) FROM accessions;
-        ''').fetchone()[0]
+        with self._read_cursor() as cur:
+            return cur.execute('''
+                SELECT COUNT(*) FROM accessions;
+            ''').fetchall()[0][0]
 
     def __iter__(self):
-        for name in (x[0] for x in self._db.cursor().execute('''
-                SELECT name FROM accessions
-                ''').fetchall()):
-            yield self[name]
+        return self.iter_accessions()
 
     def __contains__(self, item):
         if isinstance(item, Accession):
@@ -743,50 +2093,485 @@ class Cohort(Freezable):
                   FROM raw_files WHERE url=NEW.url;
             END;
         ''')
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        '''
+            Apply any migrations needed to bring the tables up to
+            self._schema_version. The version of a Cohort is stored
+            in its globals table, Cohorts frozen before versioning
+            was introduced are version 0.
+        '''
+        if 'schema_version' in self._dict:
+            version = self._dict['schema_version']
+        else:
+            version = 0
+        if version > self._schema_version:
+            self.log.warning(
+                f'Cohort schema is version {version}, this version of '
+                f'minus80 only knows up to {self._schema_version}'
+            )
+        # Migrations rewrite whole tables of what may be the only copy
+        # of the Cohort, so they are synced to disk
+        if version < self._schema_version:
+            with self._bulk_transaction(profile='durable') as cur:
+                for v in range(version+1, self._schema_version+1):
+                    getattr(self, f'_migrate_v{v}')(cur)
+                self._dict['schema_version'] = self._schema_version
+        elif version == self._schema_version \
+                and not self._has_search_index:
+            # _migrate_v2 skips the search index if FTS5 trigrams are
+            # not supported, try again in case SQLite was upgraded
+            with self._bulk_transaction(profile='durable') as cur:
+                self._migrate_v2(cur)
+        self._search_index = None
+
+    def _migrate_v1(self, cur):
+        '''
+            Add secondary indexes. metadata(AID) lookups are already
+            covered by the index behind UNIQUE(AID, key, val) and
+            aid_files(AID) by its primary key.
+        '''
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS metadata_key_val
+                ON metadata (key, val, AID);
+            CREATE INDEX IF NOT EXISTS aliases_AID
+                ON aliases (AID);
+            CREATE INDEX IF NOT EXISTS aid_files_FID
+                ON aid_files (FID, AID);
+        ''')
+
+    def _migrate_v2(self, cur):
+        '''
+            Add FTS5 trigram indexes over accession names, aliases
+            and raw file urls, kept in sync with triggers. This is
+            skipped if the SQLite library does not support it, in
+            which case searches fall back to LIKE scans.
+        '''
+        indexed = [
+            # (table, column, rowid column)
+            ('accessions', 'name', 'AID'),
+            ('aliases', 'alias', 'rowid'),
+            ('raw_files', 'url', 'FID'),
+        ]
+        for table, col, rowid in indexed:
+            try:
+                cur.execute(f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts
+                    USING fts5(
+                        {col}, content='{table}', content_rowid='{rowid}',
+                        tokenize='trigram'
+                    )
+                ''')
+            except lite.SQLError as e:
+                self.log.warning(f'Search index not available: {e}')
+                return
+        for table, col, rowid in indexed:
+            cur.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_insert
+                AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {table}_fts (rowid, {col})
+                    VALUES (NEW.{rowid}, NEW.{col});
+                END;
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_delete
+                AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, {col})
+                    VALUES ('delete', OLD.{rowid}, OLD.{col});
+                END;
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_update
+                AFTER UPDATE OF {col} ON {table} BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, {col})
+                    VALUES ('delete', OLD.{rowid}, OLD.{col});
+                    INSERT INTO {table}_fts (rowid, {col})
+                    VALUES (NEW.{rowid}, NEW.{col});
+                END;
+                INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild');
+            ''')
+
+    def _migrate_v3(self, cur):
+        '''
+            Store metadata values with their type. The val column no
+            longer has TEXT affinity and a type column records if
+            the value is a bool, int, float or str. Existing values
+            are parsed if they round trip exactly, see _parse_text.
+            The AID column is declared INTEGER so joins on it can
+            use its index.
+        '''
+        self._db.createscalarfunction(
+            'm80_parse_val', lambda val: _parse_text(val)[0], 1
+        )
+        self._db.createscalarfunction(
+            'm80_parse_type', lambda val: _parse_text(val)[1], 1
+        )
+        cur.execute('''
+            DROP INDEX IF EXISTS metadata_key_val;
+            ALTER TABLE metadata RENAME TO metadata_v2;
+            CREATE TABLE metadata (
+                AID INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                val NOT NULL,
+                type TEXT NOT NULL DEFAULT 'str',
+                FOREIGN KEY(AID) REFERENCES accessions(AID)
+                UNIQUE(AID, key, val)
+            );
+            -- Texts that parse to the same number (e.g. '23' and
+            -- '23.0') are one value now, the first one is kept
+            INSERT OR IGNORE INTO metadata (AID, key, val, type)
+            SELECT AID, key, m80_parse_val(val), m80_parse_type(val)
+            FROM metadata_v2 ORDER BY rowid;
+            DROP TABLE metadata_v2;
+            CREATE INDEX metadata_key_val ON metadata (key, val, AID);
+        ''')
+
+    def _migrate_v4(self, cur):
+        '''
+            Record the mtime and inode of raw files next to their
+            size so changes can be found without reading the files,
+            and a stale flag for files whose md5 is out of date.
+        '''
+        columns = [x[1] for x in cur.execute('PRAGMA table_info(raw_files)')]
+        for column, definition in [
+                ('mtime', 'INT DEFAULT NULL'),
+                ('inode', 'INT DEFAULT NULL'),
+                ('stale', 'INT DEFAULT 0')]:
+            if column not in columns:
+                cur.execute(
+                    f'ALTER TABLE raw_files ADD COLUMN {column} {definition}'
+                )
+
+    @property
+    def _has_search_index(self):
+        if self._search_index is None:
+            self._search_index = self._db.cursor().execute('''
+                SELECT COUNT(*) FROM sqlite_master
+                WHERE type = 'table' AND name = 'raw_files_fts'
+            ''').fetchone()[0] == 1
+        return self._search_index
+
+    def _longest_common_matches(self, name):
+        '''
+            Find the names and aliases that share the longest common
+            substring with name. The length of that substring is found
+            with a binary search where each step is a single query of
+            the trigram index, so no names are scanned in Python.
+
+            Returns
+            -------
+            A list of (name, score) tuples where the score is the
+            percent of the matched name covered by the common substring
+        '''
+        def matching(length, limit=-1):
+            substrings = set(
+                name[i:i+length] for i in range(len(name)-length+1)
+            )
+            match = ' OR '.join(
+                self._search_index_match(x) for x in substrings
+            )
+            with self._read_cursor() as cur:
+                return [x for (x,) in cur.execute('''
+                    SELECT name FROM accessions_fts
+                    WHERE accessions_fts MATCH ?
+                    UNION
+                    SELECT alias FROM aliases_fts
+                    WHERE aliases_fts MATCH ?
+                    LIMIT ?
+                ''', (match, match, limit))]
+        # Trigrams can only match substrings of 3 or more characters
+        low, high = 3, len(name)
+        longest = 0
+        while low <= high:
+            length = (low + high) // 2
+            if len(matching(length, limit=1)) > 0:
+                longest = length
+                low = length + 1
+            else:
+                high = length - 1
+        if longest == 0:
+            return []
+        return sorted(
+            ((x, int(100 * longest / len(x))) for x in matching(longest)),
+            key=lambda x: x[1], reverse=True
+        )
+
+    def _search_index_match(self, text):
+        '''
+            Return an FTS5 MATCH expression for a substring search on
+            text, or None if the trigram index cannot be used (it needs
+            at least 3 characters)
+        '''
+        if len(text) < 3 or not self._has_search_index:
+            return None
+        return '"' + text.replace('"', '""') + '"'
 
 
     def get_name(self,name):
         AID = self._get_AID(name)
-        name = self._db.cursor().execute(
-            'SELECT name FROM accessions WHERE AID = ?',(AID,)
-        ).fetchone()[0]
+        with self._read_cursor() as cur:
+            name = cur.execute(
+                'SELECT name FROM accessions WHERE AID = ?',(AID,)
+            ).fetchone()[0]
         return name
 
     def get_aliases(self,name):
         AID = self._get_AID(name)
-        aliases = [ x[0] for x in self._db.cursor().execute(
-            'SELECT alias FROM aliases WHERE AID = ?', (AID,)        
-        )]
+        with self._read_cursor() as cur:
+            aliases = [ x[0] for x in cur.execute(
+                'SELECT alias FROM aliases WHERE AID = ?', (AID,)
+            )]
         return [self.get_name(name)] + aliases
 
+    def _build_accessions(self, rows, where, params=()):
+        '''
+            Assemble Accession objects in bulk.
+
+            Parameters
+            ----------
+            rows : list of (AID, name) tuples
+                The accessions to build, in the order they
+                should be returned.
+            where : str
+                A SQL condition on AID that selects (at least) the
+                AIDs in rows, e.g. 'AID BETWEEN ? AND ?'
+            params : tuple
+                Bound parameters for the where clause
+
+            Returns
+            -------
+            A list of Accessions in the same order as rows
+        '''
+        metadata = defaultdict(dict)
+        files = defaultdict(list)
+        with self._read_cursor() as cur:
+            for AID, key, val, type in cur.execute(
+                    f'SELECT AID, key, val, type FROM metadata WHERE {where}',
+                    params):
+                metadata[AID][key] = _stored_value(val, type)
+            for AID, url in cur.execute(
+                    f'SELECT AID, url FROM files WHERE {where}', params):
+                files[AID].append(url)
+        accessions = []
+        for AID, name in rows:
+            acc_metadata = dict(metadata[AID])
+            acc_metadata['AID'] = AID
+            accessions.append(
+                Accession(name, files=files[AID], **acc_metadata)
+            )
+        return accessions
+
+    def _sample_AIDs(self, n, replace=False, seed=None, stratify=None):
+        '''
+            Draw a random sample of AIDs. AIDs are drawn uniformly from
+            1..MAX(AID) and draws that fall in gaps (deleted AIDs) are
+            rejected and redrawn. If the AIDs are too sparse for that to
+            be efficient, the list of AIDs is read and sampled directly.
+
+            Returns
+            -------
+            A list of AIDs
+        '''
+        rng = np.random.RandomState(seed)
+        if stratify is not None:
+            strata = defaultdict(list)
+            with self._read_cursor() as cur:
+                for AID, val, type in cur.execute('''
+                        SELECT AID, val, type FROM metadata WHERE key = ?
+                        ORDER BY val, AID
+                    ''', (stratify, )):
+                    strata[_stored_value(val, type)].append(AID)
+            AIDs = []
+            for val, stratum in strata.items():
+                if not replace and n > len(stratum):
+                    raise ValueError(
+                        f'Only {len(stratum)} accessions with {stratify}={val}.'
+                        f' Cannot get {n} samples. See replace parameter in help.'
+                    )
+                AIDs.extend(rng.choice(stratum, size=n, replace=replace).tolist())
+            return AIDs
+        with self._read_cursor() as cur:
+            num, max_AID = cur.execute(
+                'SELECT COUNT(*), MAX(AID) FROM accessions'
+            ).fetchall()[0]
+        if not replace and n > num:
+            raise ValueError(
+                f'Only {num} accessions in cohort. Cannot'
+                f' get {n} samples. See replace parameter in help.'
+            )
+        if n == 0:
+            return []
+        if num == 0:
+            raise ValueError('There are no accessions in the cohort')
+        density = num / max_AID
+        if density < 0.5 or (not replace and n > num / 2):
+            with self._read_cursor() as cur:
+                AIDs = [x for (x,) in cur.execute('SELECT AID FROM accessions')]
+            return rng.choice(AIDs, size=n, replace=replace).tolist()
+        sample = []
+        seen = set()
+        while len(sample) < n:
+            need = n - len(sample)
+            draws = rng.randint(1, max_AID+1, size=int(need/density)+8)
+            for AID in self._existing_AIDs(draws.tolist()):
+                if not replace:
+                    if AID in seen:
+                        continue
+                    seen.add(AID)
+                sample.append(AID)
+                if len(sample) == n:
+                    break
+        return sample
+
+    def _existing_AIDs(self, AIDs):
+        '''
+            Filter a list of AIDs to those in the Cohort, keeping
+            the order and duplicates
+        '''
+        with self._read_cursor() as cur:
+            self._reset_lookup(cur)
+            cur.executemany('''
+                INSERT INTO temp.m80_lookup (AID) VALUES (?)
+            ''', ((AID, ) for AID in AIDs))
+            return [AID for (AID, ) in cur.execute('''
+                SELECT lookup.AID FROM temp.m80_lookup lookup
+                JOIN accessions acc ON acc.AID = lookup.AID
+                ORDER BY lookup.idx
+            ''')]
+
+    def _iter_accessions_from_AIDs(self, AIDs, batch_size=5000):
+        '''
+            Lazily materialize a list of AIDs, batch_size at a time
+        '''
+        for i in range(0, len(AIDs), batch_size):
+            yield from self._accessions_from_AIDs(AIDs[i:i+batch_size])
+
+    def _reset_staging(self, cur):
+        '''
+            Create (or empty) the temp tables `m80_metadata` and
+            `m80_files` which hold incoming rows while they are
+            diffed against the metadata and files tables. Like
+            metadata.val, m80_metadata.val has no type, a comparison
+            with a different affinity could not use the metadata index.
+        '''
+        cur.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS m80_metadata (
+                AID INTEGER,
+                key TEXT,
+                val,
+                type TEXT
+            );
+            CREATE INDEX IF NOT EXISTS temp.m80_metadata_AID
+                ON m80_metadata (AID, key, val);
+            CREATE TEMP TABLE IF NOT EXISTS m80_files (
+                AID INTEGER,
+                url TEXT
+            );
+            CREATE INDEX IF NOT EXISTS temp.m80_files_AID
+                ON m80_files (AID, url);
+            DELETE FROM temp.m80_metadata;
+            DELETE FROM temp.m80_files;
+        ''')
+
+    def _reset_lookup(self, cur):
+        '''
+            Create (or empty) the temp table `m80_lookup` which is
+            used to join lists of names or AIDs against the database.
+            It has the columns: idx (the position in the list), name
+            and AID.
+        '''
+        cur.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS m80_lookup (
+                idx INTEGER PRIMARY KEY,
+                name,
+                AID INTEGER
+            );
+            DELETE FROM temp.m80_lookup;
+        ''')
+
+    def _resolve_names(self, cur, names):
+        '''
+            Resolve names, aliases or AIDs to AIDs in bulk. The
+            results are stored in temp.m80_lookup (see _reset_lookup),
+            AID is NULL for names that were not found.
+
+            Parameters
+            ----------
+            cur : cursor
+                A cursor, usually from self._bulk_transaction()
+            names : iterable
+                Names, aliases or AIDs
+        '''
+        self._reset_lookup(cur)
+        cur.executemany('''
+            INSERT INTO temp.m80_lookup (name) VALUES (?)
+        ''', ((name, ) for name in names))
+        # Same precedence as _get_AID: names, then aliases, then AIDs
+        cur.execute('''
+            UPDATE temp.m80_lookup SET AID = COALESCE(
+                (SELECT AID FROM accessions WHERE name = m80_lookup.name),
+                (SELECT AID FROM aliases WHERE alias = m80_lookup.name),
+                (SELECT AID FROM accessions WHERE AID = m80_lookup.name)
+            )
+        ''')
+
+    def _accessions_from_AIDs(self, AIDs):
+        '''
+            Materialize a list of AIDs as Accessions in bulk. AIDs
+            that are not in the Cohort are skipped.
+        '''
+        with self._read_cursor() as cur:
+            self._reset_lookup(cur)
+            cur.executemany('''
+                INSERT INTO temp.m80_lookup (AID) VALUES (?)
+            ''', ((AID, ) for AID in AIDs))
+            rows = cur.execute('''
+                SELECT acc.AID, acc.name
+                FROM temp.m80_lookup lookup
+                JOIN accessions acc ON acc.AID = lookup.AID
+                ORDER BY lookup.idx
+            ''').fetchall()
+            return self._build_accessions(
+                rows, 'AID IN (SELECT AID FROM temp.m80_lookup)'
+            )
 
-    @lru_cache(maxsize=32768)
     def _get_AID(self, name):
         '''
-            Return a Sample ID (AID)
+            Return a Sample ID (AID). Names and aliases are cached
+            in self._AID_cache.
         '''
         if isinstance(name, Accession):
             name = name.name
-        cur = self._db.cursor()
-        try:
-            return cur.execute(
-                'SELECT AID FROM accessions WHERE name = ?', (name, )
-            ).fetchone()[0]
-        except TypeError:
-            pass
-        try:
-            return cur.execute(
-                'SELECT AID FROM aliases WHERE alias = ?', (name, )
-            ).fetchone()[0]
-        except TypeError:
-            pass
-        try:
-            return cur.execute(
+        if isinstance(name, str):
+            AID = self._AID_cache.get(name)
+            if AID is not None:
+                return AID
+        with self._read_cursor() as cur:
+            for query in (
+                    'SELECT AID FROM accessions WHERE name = ?',
+                    'SELECT AID FROM aliases WHERE alias = ?'):
+                AID = cur.execute(query, (name, )).fetchall()
+                if len(AID) > 0:
+                    if isinstance(name, str):
+                        self._AID_cache[name] = AID[0][0]
+                    return AID[0][0]
+            AID = cur.execute(
                 'SELECT AID FROM accessions WHERE AID = ?', (name,)
-            ).fetchone()[0]
-        except TypeError:
+            ).fetchall()
+        if len(AID) == 0:
             raise NameError(f'{name} not in Cohort')
+        return AID[0][0]
 
+    def preload_AIDs(self):
+        '''
+            Warm up the name -> AID cache used by lookups with all
+            of the names and aliases in the Cohort (up to the cache
+            size) using a single query.
+        '''
+        with self._read_cursor() as cur:
+            self._AID_cache.update(cur.execute('''
+                SELECT name, AID FROM accessions
+                UNION ALL
+                SELECT alias, AID FROM aliases
+                LIMIT ?
+            ''', (self._AID_cache.maxsize, )))
 
     #------------------------------------------------------#
     #               Class Methods                          #
@@ -814,6 +2599,30 @@ class Cohort(Freezable):
         self.add_accessions(accessions)
         return self
 
+    @classmethod
+    def merge(cls, name, cohorts):
+        '''
+        Create a Cohort from the accessions of other Cohorts.
+        Accessions with the same name are merged into one, the
+        metadata of later Cohorts take precedence.
+
+        Parameters
+        ----------
+        name : str
+            The name of the Cohort
+        cohorts : iterable of Cohorts
+            The Cohorts to merge
+
+        Returns
+        -------
+        A Cohort object
+
+        '''
+        self = cls(name)
+        for cohort in cohorts:
+            self._copy_from(cohort)
+        return self
+
 
 
 class interactive_assign_files(object):
@@ -5,6 +5,8 @@ import re
 import bcolz as bcz
 
 import os as os
+import queue
+import threading
 import numpy as np
 import pandas as pd
 
@@ -22,6 +24,20 @@ except ModuleNotFoundError as e:
 
 __all__ = ['Freezable']
 
+# The pragmas set for the duration of a _bulk_transaction. The
+# connection is restored to its previous settings afterwards.
+DURABILITY_PROFILES = {
+    # Nothing is synced and the rollback journal is kept in memory,
+    # a crash during the transaction can corrupt the database
+    'fast-unsafe': {'synchronous': 0, 'journal_mode': 'memory'},
+    # Commits are not synced on their own. With WAL journaling a crash
+    # can lose the latest commits but not corrupt the database, use
+    # with Freezable.group_commit to sync batches of transactions
+    'group-commit': {'synchronous': 1},
+    # Every commit is synced to disk
+    'durable': {'synchronous': 2},
+}
+
 class sqlite_dict(object):
     def __init__(self,con):
         self._con = con
@@ -86,6 +102,74 @@ class sqlite_dict(object):
         )
 
 
+class ConnectionPool(object):
+    '''
+        A pool of read only connections to a sqlite database. Each
+        thread checks out its own connection, connections are opened
+        as needed up to size and threads wait for one to be returned
+        after that.
+    '''
+
+    def __init__(self, filename, size=4, busy_timeout=5000):
+        self.filename = filename
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._num_open = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        con = lite.Connection(
+            self.filename, flags=lite.SQLITE_OPEN_READONLY
+        )
+        con.setbusytimeout(self.busy_timeout)
+        return con
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._num_open < self.size:
+                self._num_open += 1
+                return self._connect()
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        '''
+            Check out a connection for the current thread. Nested
+            calls on the same thread get the same connection.
+        '''
+        local = self._local
+        if getattr(local, 'depth', 0) == 0:
+            local.con = self._checkout()
+            local.depth = 0
+        local.depth += 1
+        try:
+            yield local.con
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                con, local.con = local.con, None
+                self._idle.put(con)
+
+    def close(self):
+        '''
+            Close the idle connections
+        '''
+        while True:
+            try:
+                con = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            con.close()
+            with self._lock:
+                self._num_open -= 1
+
+
 class Freezable(object):
 
     '''
@@ -104,6 +188,9 @@ class Freezable(object):
 
     '''
 
+    # The default DURABILITY_PROFILES entry used by _bulk_transaction
+    durability = 'fast-unsafe'
+
     def __init__(self, name, parent=None, basedir=None):
         '''
         Initialize the Freezable Object.
@@ -145,6 +232,20 @@ class Freezable(object):
 
         # Get a handle to the sql database
         self._db = self._sqlite()
+        # The current connection settings, so pragmas are only
+        # issued when they change. WAL is persistent, it is kept
+        # if concurrency was enabled before.
+        cur = self._db.cursor()
+        self._pragmas = {
+            pragma: cur.execute(f'PRAGMA main.{pragma}').fetchall()[0][0]
+            for pragma in ('synchronous', 'journal_mode')
+        }
+        self._read_pool = None
+        # The thread with a _bulk_transaction open and how deeply nested
+        self._writer = None
+        self._write_depth = 0
+        # Set by group_commit: [transactions per commit, pending]
+        self._group_commit = None
         # Set up a table
         self._dict = sqlite_dict(self._db) 
 
@@ -155,28 +256,196 @@ class Freezable(object):
         '''
         self._children.append(child)
 
+    @property
+    def _wal(self):
+        return self._pragmas['journal_mode'] == 'wal'
+
+    def _set_pragmas(self, cur, pragmas):
+        '''
+            Set the pragmas that differ from the current connection
+            settings, returns the previous values of those that changed.
+            Only the main database is changed, not attached ones.
+        '''
+        previous = {}
+        for pragma, val in pragmas.items():
+            if pragma == 'journal_mode' and self._wal:
+                # Leaving WAL mode would block concurrent readers
+                continue
+            if self._pragmas[pragma] != val:
+                previous[pragma] = self._pragmas[pragma]
+                cur.execute(f'PRAGMA main.{pragma} = {val}').fetchall()
+                self._pragmas[pragma] = val
+        return previous
+
     @contextmanager
-    def _bulk_transaction(self):
+    def _bulk_transaction(self, profile=None):
         '''
             This is a context manager that handles bulk transaction.
             i.e. this context will handle the BEGIN, END and appropriate
             ROLLBACKS.
 
+            The pragmas of a durability profile (see DURABILITY_PROFILES)
+            are set by the outermost transaction and the previous
+            settings are restored once it is committed.
+
+            Parameters
+            ----------
+            profile : str (default: None)
+                The name of the durability profile, self.durability
+                is used if None. Ignored for nested transactions.
+
             Usage:
             >>> with x._bulk_transaction() as cur:
                      cur.execute('INSERT INTO table XXX VALUES YYY')
         '''
+        if profile is None:
+            profile = self.durability
+        if profile not in DURABILITY_PROFILES:
+            raise ValueError(
+                f'{profile} is not one of {list(DURABILITY_PROFILES)}'
+            )
         cur = self._db.cursor()
-        cur.execute('PRAGMA synchronous = off')
-        cur.execute('PRAGMA journal_mode = memory')
+        previous = {}
+        if self._write_depth == 0:
+            previous = self._set_pragmas(cur, DURABILITY_PROFILES[profile])
         cur.execute('SAVEPOINT bulk_transaction')
+        self._writer = threading.get_ident()
+        self._write_depth += 1
         try:
             yield cur
         except Exception as e:
             cur.execute('ROLLBACK TO SAVEPOINT bulk_transaction')
             raise e
         finally:
-            cur.execute('RELEASE SAVEPOINT bulk_transaction')
+            released = False
+            try:
+                cur.execute('RELEASE SAVEPOINT bulk_transaction')
+                released = True
+            except Exception:
+                # e.g. a BusyError on commit, do not leave the
+                # savepoint open
+                try:
+                    if self._write_depth == 1:
+                        cur.execute('ROLLBACK')
+                    else:
+                        cur.execute('''
+                            ROLLBACK TO SAVEPOINT bulk_transaction;
+                            RELEASE SAVEPOINT bulk_transaction;
+                        ''')
+                except Exception:
+                    pass
+                raise
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._writer = None
+                    self._set_pragmas(cur, previous)
+                elif released and self._write_depth == 1 \
+                        and self._group_commit is not None:
+                    self._group_commit[1] += 1
+                    if self._group_commit[1] >= self._group_commit[0]:
+                        # Commit the batch and start the next one
+                        cur.execute('''
+                            RELEASE SAVEPOINT bulk_transaction;
+                            SAVEPOINT bulk_transaction;
+                        ''')
+                        self._group_commit[1] = 0
+
+    @contextmanager
+    def group_commit(self, every=1000, profile='group-commit'):
+        '''
+            Batch the transactions made in this context so they are
+            committed (and synced to disk) together, every transactions
+            at a time and when the context exits. If the context raises,
+            only the transactions since the last commit are rolled back.
+
+            Parameters
+            ----------
+            every : int (default: 1000)
+                The number of transactions per commit
+            profile : str (default: 'group-commit')
+                The durability profile used while batching
+
+            Usage:
+            >>> with x.group_commit():
+                     for accession in accessions:
+                         x.add_accession(accession)
+        '''
+        if self._group_commit is not None or self._write_depth > 0:
+            # Already batched by an enclosing transaction
+            yield
+            return
+        self._group_commit = [every, 0]
+        try:
+            with self._bulk_transaction(profile=profile):
+                yield
+        finally:
+            self._group_commit = None
+
+    @contextmanager
+    def _read_cursor(self):
+        '''
+            A cursor for queries that do not change the database
+            (they may still use temp tables). The queries run in one
+            read transaction and see a consistent snapshot. After
+            enable_concurrency, the cursor comes from a read only
+            connection checked out for the current thread, unless
+            the thread has a _bulk_transaction open whose changes
+            need to be visible.
+
+            Usage:
+            >>> with x._read_cursor() as cur:
+                     cur.execute('SELECT * FROM table')
+        '''
+        if self._read_pool is None \
+                or self._writer == threading.get_ident():
+            cur = self._db.cursor()
+            cur.execute('SAVEPOINT read_transaction')
+            try:
+                yield cur
+            finally:
+                cur.execute('RELEASE SAVEPOINT read_transaction')
+        else:
+            with self._read_pool.connection() as con:
+                cur = con.cursor()
+                cur.execute('SAVEPOINT read_transaction')
+                try:
+                    yield cur
+                finally:
+                    cur.execute('RELEASE SAVEPOINT read_transaction')
+
+    def enable_concurrency(self, busy_timeout=5000, pool_size=4):
+        '''
+            Allow other threads and processes to read the database
+            while it is being written to. This switches the database
+            to WAL journaling (which persists once set), sets how
+            long to wait on a locked database before raising a
+            BusyError and creates a pool of read only connections
+            which are handed out per thread.
+
+            Parameters
+            ----------
+            busy_timeout : int (default: 5000)
+                Milliseconds to wait for a lock
+            pool_size : int (default: 4)
+                The maximum number of read only connections
+        '''
+        self._db.setbusytimeout(busy_timeout)
+        (journal_mode, ) = self._db.cursor().execute(
+            'PRAGMA journal_mode = wal'
+        ).fetchall()[0]
+        self._pragmas['journal_mode'] = journal_mode
+        if journal_mode != 'wal':
+            raise ValueError(
+                f'Could not enable WAL journaling (got {journal_mode})'
+            )
+        if self._read_pool is not None:
+            self._read_pool.close()
+        self._read_pool = ConnectionPool(
+            self._get_dbpath('db.sqlite'),
+            size=pool_size,
+            busy_timeout=busy_timeout
+        )
 
     def _query(self,q):
         cur = self._db.cursor().execute(q)
@@ -251,14 +520,12 @@ class Freezable(object):
             bcz.carray(array, mode='w', rootdir=os.path.join(path, name))
 
     def _bcolz(self, tblname, df=None, m80name=None, m80type=None,
-               blaze=False):
+               blaze=False, columns=None):
         '''
-            This is the access point to the bcolz database
+            This is the access point to the bcolz database. When getting
+            a table, columns can be a list of column names in which case
+            only those columns (plus the index) are read from disk.
         '''
-        try:
-            import blaze as blz
-        except FutureWarning: # pragma: no cover
-            pass
         import warnings
         # from flask.exthook import ExtDeprecationWarning
         # warnings.simplefilter('ignore', ExtDeprecationWarning)
@@ -281,6 +548,9 @@ class Freezable(object):
                     f'could not open database for {m80type}:{m80name} '
                 )
             else:
+                if blaze:
+                    # blaze is only needed (and imported) when asked for
+                    import blaze as blz
                 if len(df) == 0:
                     df = pd.DataFrame()
                     if blaze:
@@ -289,8 +559,14 @@ class Freezable(object):
                     if blaze:
                         df = blz.data(df)
                     else:
-                        df = df.todataframe()
-                if not blaze and f'{tblname}_index' in self._dict:
+                        if columns is not None \
+                                and f'{tblname}_index' in self._dict:
+                            index = self._dict[f'{tblname}_index']
+                            columns = [index] + \
+                                [x for x in columns if x != index]
+                        df = df.todataframe(columns=columns)
+                if not blaze and f'{tblname}_index' in self._dict \
+                        and self._dict[f'{tblname}_index'] in df.columns:
                     df.set_index(
                         self._dict[f'{tblname}_index'], 
                         inplace=True)
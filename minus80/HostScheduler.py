@@ -0,0 +1,196 @@
+import asyncio
+import asyncssh
+import logging
+import time
+
+from collections import deque
+from tqdm import tqdm
+
+__all__ = ['HostScheduler']
+
+
+class _Lane(object):
+    '''
+        The pending batches, concurrency limit and throughput of
+        one host
+    '''
+
+    def __init__(self, host, max_limit):
+        self.host = host
+        self.max_limit = max_limit
+        self.limit = 1
+        self.queue = deque()
+        # The best bytes/s of batches that read data and files/s of
+        # those that do not (e.g. only stat), which are not comparable
+        self.best = {'bytes': 0, 'files': 0}
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.pbar = None
+
+    def succeeded(self, n_items, n_bytes, seconds):
+        '''
+            Additive increase: open another slot unless the
+            throughput dropped to under half of the best seen in
+            the same unit, which means the host is saturated.
+        '''
+        self.items += n_items
+        self.bytes += n_bytes
+        unit = 'bytes' if n_bytes > 0 else 'files'
+        rate = (n_bytes or n_items) / max(seconds, 1e-6)
+        if rate < self.best[unit] / 2:
+            self.limit = max(1, self.limit - 1)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1)
+        self.best[unit] = max(self.best[unit], rate)
+
+    def errored(self):
+        '''
+            Multiplicative decrease
+        '''
+        self.errors += 1
+        self.limit = max(1, self.limit // 2)
+
+    def stats(self):
+        seconds = time.monotonic() - self.start
+        return {
+            'files': self.items,
+            'bytes': self.bytes,
+            'seconds': seconds,
+            'errors': self.errors,
+            'failed': self.failed,
+            'limit': self.limit,
+        }
+
+
+class HostScheduler(object):
+    '''
+        Runs batches of work on many hosts at once. Each host gets
+        its own lane so a slow host does not hold up the others. A
+        lane starts with one batch in flight and adapts to the host:
+        the limit goes up by one after each batch (up to max_per_host)
+        and is halved after an error or lowered when the throughput
+        falls. At most max_tasks batches run at once over all hosts.
+
+        >>> x = HostScheduler(max_tasks=16, max_per_host=4)
+        >>> stats = await x.run(batches, fn)
+    '''
+
+    def __init__(self, max_tasks=16, max_per_host=4, max_retries=3,
+                 backoff=1, retry_on=(asyncssh.Error, OSError),
+                 progress=True, log=None):
+        '''
+        Create a new HostScheduler.
+
+        Parameters
+        ----------
+        max_tasks : int (default: 16)
+            The maximum number of batches in flight over all hosts
+        max_per_host : int (default: 4)
+            The maximum number of batches in flight on one host
+        max_retries : int (default: 3)
+            The number of times a batch that raised one of retry_on
+            is retried before it is given up on
+        backoff : float (default: 1)
+            Seconds to wait before the first retry of a batch, this
+            doubles on each further retry
+        retry_on : tuple of Exceptions
+            The errors that are retried, others are raised
+        progress : bool (default: True)
+            Show a progress bar per host
+        log : logging.Logger (default: None)
+            Where the per host throughput is reported
+        '''
+        self.max_tasks = max_tasks
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_on = retry_on
+        self.progress = progress
+        self.log = log or logging.getLogger('minus80.HostScheduler')
+
+    async def run(self, batches, fn):
+        '''
+        Run fn on each batch.
+
+        Parameters
+        ----------
+        batches : iterable of (host, items, n_bytes) tuples
+            The batches of work. n_bytes is the (estimated) amount
+            of data the batch reads, used to measure throughput.
+        fn : coroutine function
+            Called with the items of each batch
+
+        Returns
+        -------
+        A dict of host -> dict of stats (files, bytes, seconds,
+        errors, failed and the final limit)
+        '''
+        lanes = {}
+        for host, items, n_bytes in batches:
+            if host not in lanes:
+                lanes[host] = _Lane(host, self.max_per_host)
+            lanes[host].queue.append((items, n_bytes, 0))
+        slots = asyncio.Semaphore(self.max_tasks)
+        for i, lane in enumerate(lanes.values()):
+            lane.pbar = tqdm(
+                total=sum(len(x[0]) for x in lane.queue), desc=str(lane.host),
+                unit='file', position=i, disable=not self.progress
+            )
+        try:
+            await asyncio.gather(*[
+                self._drain(lane, fn, slots) for lane in lanes.values()
+            ])
+        finally:
+            for lane in lanes.values():
+                lane.pbar.close()
+        stats = {}
+        for host, lane in lanes.items():
+            stats[host] = lane.stats()
+            self.log.info(
+                f'{host}: {lane.items} files, '
+                f'{lane.bytes / 2**20 / stats[host]["seconds"]:.1f} MB/s, '
+                f'{lane.errors} errors, {lane.failed} failed'
+            )
+        return stats
+
+    async def _drain(self, lane, fn, slots):
+        running = set()
+        while lane.queue or running:
+            while lane.queue and len(running) < lane.limit:
+                running.add(asyncio.ensure_future(
+                    self._run_batch(lane, fn, slots, *lane.queue.popleft())
+                ))
+            done, running = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                # Raise errors that are not retried
+                task.result()
+
+    async def _run_batch(self, lane, fn, slots, items, n_bytes, attempt):
+        if attempt > 0:
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+        async with slots:
+            start = time.monotonic()
+            try:
+                await fn(items)
+            except self.retry_on as e:
+                lane.errored()
+                if attempt < self.max_retries:
+                    lane.queue.append((items, n_bytes, attempt + 1))
+                else:
+                    lane.failed += len(items)
+                    lane.pbar.update(len(items))
+                    self.log.warning(
+                        f'{lane.host}: gave up on {len(items)} files: {e}'
+                    )
+                return
+            lane.succeeded(len(items), n_bytes, time.monotonic() - start)
+        lane.pbar.update(len(items))
+        lane.pbar.set_postfix(
+            limit=lane.limit,
+            MBps=f'{lane.bytes / 2**20 / (time.monotonic() - lane.start):.1f}'
+        )
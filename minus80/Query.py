@@ -0,0 +1,154 @@
+import numbers
+
+__all__ = ['Query']
+
+
+class Query(object):
+    '''
+        A Query is a predicate on Accession metadata. Queries are
+        created from a metadata key, compared to a value and then
+        combined using & (and), | (or) and ~ (not). They are
+        evaluated by Cohort.search_metadata using bound parameters
+        and the metadata(key, val) index. Values are compared with
+        their type, e.g. Q('age') == 25 does not match '25'.
+
+        >>> from minus80 import Query as Q
+        >>> q = (Q('type') == 'WGS') & Q('age').between(20, 30)
+        >>> q = Q('tissue').isin(['fat', 'muscle']) | ~Q('id').startswith('X')
+        >>> cohort.search_metadata(q)
+    '''
+
+    def __init__(self, key=None, sql=None, params=()):
+        '''
+        Create a new Query.
+
+        Parameters
+        ----------
+        key : str
+            The metadata key the Query compares against
+        sql : str
+            A SQL statement returning the matching AIDs. This
+            is set by the comparison methods, not by users.
+        params : tuple
+            Bound parameters for sql
+        '''
+        self.key = key
+        self.sql = sql
+        self.params = tuple(params)
+
+    def __repr__(self): # pragma: no cover
+        if self.sql is None:
+            return f'Query({self.key!r})'
+        return f'Query({self.sql!r}, {self.params!r})'
+
+    def _leaf(self, condition, *params):
+        '''
+            Build a Query matching AIDs with a metadata value
+            on self.key that satisfies the SQL condition
+        '''
+        if self.key is None or self.sql is not None:
+            raise ValueError('Only a Query on a key can be compared')
+        return Query(
+            sql=f'SELECT AID FROM metadata WHERE key = ? AND {condition}',
+            params=(self.key, ) + params
+        )
+
+    def _compiled(self):
+        if self.sql is None:
+            raise ValueError(
+                f'Query({self.key!r}) must be compared to a value first'
+            )
+        return self.sql, self.params
+
+    # Comparisons --------------------------------------
+
+    def __eq__(self, val):
+        return self._leaf('val = ?', val)
+
+    def __ne__(self, val):
+        # Includes accessions that do not have the key at all
+        return ~(self == val)
+
+    def isin(self, vals):
+        '''
+            Match any of the values in vals
+        '''
+        vals = tuple(vals)
+        if len(vals) == 0:
+            raise ValueError('isin requires at least one value')
+        placeholders = ', '.join('?' for _ in vals)
+        return self._leaf(f'val IN ({placeholders})', *vals)
+
+    def startswith(self, prefix):
+        '''
+            Match values starting with prefix. This is expressed
+            as a range so the index can be used.
+        '''
+        if len(prefix) == 0:
+            return self._leaf('val >= ?', '')
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self._leaf('val >= ? AND val < ?', prefix, upper)
+
+    def _typed(self, condition, *params):
+        '''
+            Range comparisons only match values of the same type as
+            params: numbers (including bools, as 0/1) or strs. SQLite
+            sorts every number before every str, so the type is
+            selected with a bound on val and the index is still used.
+        '''
+        if all(isinstance(x, numbers.Real) for x in params):
+            bound = "val < ''"
+        elif all(isinstance(x, str) for x in params):
+            bound = "val >= ''"
+        else:
+            raise TypeError(
+                f'Cannot compare {self.key!r} to {params!r}, '
+                'use numbers or strs'
+            )
+        return self._leaf(f'val {condition} AND {bound}', *params)
+
+    def __gt__(self, val):
+        return self._typed('> ?', val)
+
+    def __ge__(self, val):
+        return self._typed('>= ?', val)
+
+    def __lt__(self, val):
+        return self._typed('< ?', val)
+
+    def __le__(self, val):
+        return self._typed('<= ?', val)
+
+    def between(self, low, high):
+        '''
+            Match values in the closed interval [low, high]
+        '''
+        return self._typed('BETWEEN ? AND ?', low, high)
+
+    # Combinations -------------------------------------
+
+    def _combine(self, other, operator):
+        if not isinstance(other, Query):
+            return NotImplemented
+        sql, params = self._compiled()
+        other_sql, other_params = other._compiled()
+        return Query(
+            sql=(
+                f'SELECT AID FROM ({sql}) '
+                f'{operator} SELECT AID FROM ({other_sql})'
+            ),
+            params=params + other_params
+        )
+
+    def __and__(self, other):
+        return self._combine(other, 'INTERSECT')
+
+    def __or__(self, other):
+        return self._combine(other, 'UNION')
+
+    def __invert__(self):
+        sql, params = self._compiled()
+        return Query(
+            sql=f'SELECT AID FROM accessions EXCEPT SELECT AID FROM ({sql})',
+            params=params
+        )
@@ -0,0 +1,166 @@
+import asyncio
+import asyncssh
+import getpass
+
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+__all__ = ['SSHPool']
+
+# The errors after which a connection is assumed to be broken
+_DISCONNECTS = (
+    asyncssh.DisconnectError,
+    asyncssh.ChannelOpenError,
+    ConnectionError,
+)
+
+
+class SSHPool(object):
+    '''
+        A pool of SSH connections shared by coroutines. At most
+        max_connections are opened to each (host, user), idle
+        connections are kept alive and reused and a connection
+        that was dropped is replaced by a new one.
+
+        >>> pool = SSHPool.shared()
+        >>> result = await pool.run('host', 'md5sum file.fastq')
+    '''
+
+    _shared = None
+
+    def __init__(self, max_connections=8, keepalive_interval=30,
+                 **connect_kwargs):
+        '''
+        Create a new SSHPool.
+
+        Parameters
+        ----------
+        max_connections : int (default: 8)
+            The maximum number of connections to a (host, user)
+        keepalive_interval : int (default: 30)
+            Seconds between keepalive messages on open connections
+        connect_kwargs : dict
+            Passed on to asyncssh.connect
+        '''
+        self.max_connections = max_connections
+        self.connect_kwargs = dict(
+            keepalive_interval=keepalive_interval, **connect_kwargs
+        )
+        self._loop = None
+        self._closer = None
+        self._idle = defaultdict(list)
+        self._slots = {}
+
+    @classmethod
+    def shared(cls):
+        '''
+            The pool shared by Cohorts and Accessions
+        '''
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def __len__(self):
+        return sum(len(x) for x in self._idle.values())
+
+    def _check_loop(self):
+        # Connections belong to the event loop they were opened in,
+        # each loop gets its own idle connections which are closed
+        # when the loop finishes
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._idle = defaultdict(list)
+            self._slots = {}
+            self._loop = loop
+            self._closer = loop.create_task(self._close_on_exit(self._idle))
+
+    @staticmethod
+    async def _close_on_exit(idle):
+        '''
+            Wait until cancelled, then close the connections in idle.
+            asyncio.run cancels the remaining tasks before it closes
+            the loop, so the connections opened in each asyncio.run
+            are closed rather than leaked.
+        '''
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            for conns in idle.values():
+                for conn in conns:
+                    conn.close()
+                    await conn.wait_closed()
+            idle.clear()
+
+    async def _connect(self, hostname, username):
+        return await asyncssh.connect(
+            hostname, username=username, **self.connect_kwargs
+        )
+
+    @asynccontextmanager
+    async def connection(self, hostname, username=None):
+        '''
+            Check out a connection to hostname, waiting for one if
+            max_connections are in use. A connection that was dropped
+            (one of _DISCONNECTS was raised) is closed rather than
+            returned to the pool.
+        '''
+        self._check_loop()
+        key = (hostname, username or getpass.getuser())
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(self.max_connections)
+        async with self._slots[key]:
+            idle = self._idle[key]
+            conn = idle.pop() if idle else await self._connect(*key)
+            broken = False
+            try:
+                yield conn
+            except _DISCONNECTS:
+                broken = True
+                raise
+            finally:
+                if broken:
+                    conn.close()
+                else:
+                    idle.append(conn)
+
+    async def run(self, hostname, command, username=None, **kwargs):
+        '''
+            Run a command on hostname using a pooled connection. If
+            the connection was dropped (e.g. an idle connection timed
+            out) the command is retried once on a new connection.
+
+            Parameters
+            ----------
+            hostname : str
+                The host to run the command on
+            command : str
+                The command
+            username : str (default: None)
+                The user to connect as, the current user if None
+            kwargs : dict
+                Passed on to SSHClientConnection.run, e.g. check=False
+
+            Returns
+            -------
+            An asyncssh.SSHCompletedProcess
+        '''
+        try:
+            async with self.connection(hostname, username) as conn:
+                return await conn.run(command, **kwargs)
+        except _DISCONNECTS:
+            # The other idle connections to the host are likely stale too
+            key = (hostname, username or getpass.getuser())
+            for conn in self._idle.pop(key, []):
+                conn.close()
+            async with self.connection(hostname, username) as conn:
+                return await conn.run(command, **kwargs)
+
+    async def close(self):
+        '''
+            Close the idle connections
+        '''
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+                await conn.wait_closed()
+        self._idle.clear()
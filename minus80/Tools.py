@@ -10,10 +10,10 @@ from subprocess import check_call,CalledProcessError
 __all__ = ['available', 'delete']
 
 
-def install_apsw(method='pip',version='3.27.2',tag='-r1'):
+def install_apsw(method='pip',version='3.34.0',tag='-r1'):
     if method == 'pip':
         print('Installing apsw from GitHub using ')
-        version = '3.27.2'
+        version = '3.34.0'
         tag = '-r1'
         check_call(f'''\
             pip install  \
@@ -24,6 +24,7 @@ def install_apsw(method='pip',version='3.27.2',tag='-r1'):
             --global-option=--all \
             --global-option=build  \
             --global-option=--enable=rtree \
+            --global-option=--enable=fts5 \
         '''.split())
     else:
         raise ValueError(f'{method} not supported to install apsw')
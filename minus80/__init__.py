@@ -3,6 +3,7 @@ __version__ = '0.3.3'
 
 from .Freezable import Freezable
 from .Accession import Accession
+from .Query     import Query
 from .Cohort    import Cohort
 from .CloudData import CloudData
 import minus80.Tools as tools
@@ -48,6 +48,44 @@ def delete(dtype,name):
 
 cli.add_command(delete)
 
+#----------------------------
+#    Cohort Commands
+#----------------------------
+@click.group()
+def cohort():
+    '''
+    Manage your minus80 Cohorts.
+    '''
+
+cli.add_command(cohort)
+
+@click.command('import')
+@click.argument('name', metavar='<name>')
+@click.argument('path', metavar='<path>', type=click.Path(exists=True))
+@click.option('--name-col', required=True,
+    help='The column containing the accession names.'
+)
+@click.option('--chunksize', default=50000, show_default=True,
+    help='The number of rows to read and insert at a time.'
+)
+@click.option('--sep', default=None,
+    help='The delimiter for text files. Defaults to a tab for .tsv/.txt files and a comma otherwise.'
+)
+def import_table(name, path, name_col, chunksize, sep):
+    '''
+    \b
+    Import a CSV/TSV/Parquet sample sheet into a Cohort.
+
+    \b
+    Positional Arguments:
+    <name> - the name of the Cohort, it is created if it does not exist.
+    <path> - the sample sheet, one accession per row.
+    '''
+    x = m80.Cohort(name)
+    x.import_table(path, name_col, chunksize=chunksize, sep=sep)
+
+cohort.add_command(import_table)
+
 #----------------------------
 #    Cloud Commands
 #----------------------------
@@ -25,10 +25,10 @@ def find_version(*file_paths):
         return version_match.group(1)
     raise RuntimeError("Unable to find version string.")
 
-def install_apsw(method='pip',version='3.27.2',tag='-r1'):
+def install_apsw(method='pip',version='3.34.0',tag='-r1'):
     if method == 'pip':
         print('Installing apsw from GitHub using ')
-        version = '3.27.2'
+        version = '3.34.0'
         tag = '-r1'
         check_call(f'''\
             pip install  \
@@ -39,6 +39,7 @@ def install_apsw(method='pip',version='3.27.2',tag='-r1'):
             --global-option=--all \
             --global-option=build  \
             --global-option=--enable=rtree \
+            --global-option=--enable=fts5 \
         '''.split())
     else:
         raise ValueError(f'{method} not supported to install apsw')
@@ -117,15 +118,14 @@ setup(
         'termcolor >= 1.1.0',
         'pyyaml >= 3.12',
         'click >= 6.7',
-        'asyncssh >= 1.12.2',
+        'asyncssh >= 1.16.0',
         'networkx == 1.11',
         'urllib3 == 1.24.2',
         'boto3 >= 1.7.84',
         'requests >= 2.19.1',
         'fuzzywuzzy >= 0.17.0',
         'python-Levenshtein >= 0.12.0',
-        'tqdm >= 4.28.1',
-        'backoff >= 1.7.1'
+        'tqdm >= 4.28.1'
     ],
     extras_require={
         'docs' : ['ipython>=6.5.0','matplotlib>=2.2.3']
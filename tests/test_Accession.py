@@ -46,3 +46,26 @@ def test_accession_files_are_set(simpleAccession):
     simpleAccession.add_file('/path/to/file.txt')
     assert len(simpleAccession.files) == len_files
 
+
+def test_check_files_closes_connections(monkeypatch):
+    from minus80.SSHPool import SSHPool
+    opened = []
+    class FakeConnection(object):
+        closed = False
+        async def run(self, command, **kwargs):
+            return type('Result',(),{'stdout':'Y' if 'present' in command else 'N'})
+        def close(self):
+            self.closed = True
+        async def wait_closed(self):
+            pass
+    pool = SSHPool()
+    async def connect(hostname, username):
+        opened.append(FakeConnection())
+        return opened[-1]
+    monkeypatch.setattr(pool,'_connect',connect)
+    monkeypatch.setattr(SSHPool,'_shared',pool)
+    x = Accession('checked',files=[
+        'ssh://user@host/data/present.txt','ssh://user@host/data/gone.txt'
+    ])
+    assert x._check_files() == ['ssh://user@host/data/gone.txt']
+    assert len(opened) > 0 and all(conn.closed for conn in opened)
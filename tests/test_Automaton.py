@@ -0,0 +1,11 @@
+import pytest
+from minus80.Automaton import Automaton
+
+def test_overlapping_patterns():
+    x = Automaton({'he':'he','she':'she','his':'his','hers':'hers'})
+    assert dict(x.search('ushers')) == {'she':3,'he':2,'hers':4}
+
+def test_longest_per_value():
+    x = Automaton({'Sample1':'Sample1','Sample1_Fat':'Sample1','Sample10':'Sample10'})
+    assert x.search('SAMPLE1_FAT_L007.fastq') == [('Sample1',11)]
+    assert x.search('nothing here') == []
@@ -14,7 +14,7 @@ def test_get_AID_from_name(simpleCohort):
     assert simpleCohort._get_AID('Sample1') == 1
 
 def test_get_AID(simpleCohort):
-    aid_map = simpleCohort._AID_mapping['Sample1'] == 1 
+    assert simpleCohort._get_AID(simpleCohort['Sample1']) == 1
 
 def test_add_accession(simpleCohort):
     a = Accession('Sample4',files=['file1.txt','file2.txt'],type='CHIP')
@@ -36,6 +36,20 @@ def test_getitem(simpleCohort):
     x = simpleCohort['Sample1']
     assert isinstance(x,Accession)
 
+def test_getitem_list(simpleCohort):
+    x = simpleCohort[['Sample2','Sample1']]
+    assert [a.name for a in x] == ['Sample2','Sample1']
+
+def test_get_many_missing(simpleCohort):
+    AID = simpleCohort._get_AID('Sample3')
+    x,missing = simpleCohort.get_many(
+        ['Sample1','NOT_A_SAMPLE',AID],
+        return_missing=True
+    )
+    assert [a.name for a in x] == ['Sample1','Sample3']
+    assert x[1].metadata == simpleCohort['Sample3'].metadata
+    assert missing == ['NOT_A_SAMPLE']
+
 def test_len(simpleCohort):
     assert isinstance(len(simpleCohort),int)
 
@@ -46,6 +60,13 @@ def test_iter(simpleCohort):
     for x in simpleCohort:
         assert isinstance(x,Accession)
 
+def test_iter_accessions_batches(simpleCohort):
+    batched = list(simpleCohort.iter_accessions(batch_size=1))
+    assert [x.name for x in batched] == [x.name for x in simpleCohort]
+    for x in batched:
+        assert x.metadata == simpleCohort[x.name].metadata
+        assert x.files == simpleCohort[x.name].files
+
 def test_random_accession(simpleCohort):
     a = simpleCohort.random_accession()
     assert isinstance(a,Accession)
@@ -62,6 +83,26 @@ def test_random_accessions_replace(simpleCohort):
     a = simpleCohort.random_accessions(n=2,replace=True)
     assert all([isinstance(k,Accession) for k in a])
 
+def test_random_accessions_seed(simpleCohort):
+    a = [x.name for x in simpleCohort.random_accessions(n=3,seed=42)]
+    b = [x.name for x in simpleCohort.random_accessions(n=3,seed=42)]
+    assert a == b
+    assert len(set(a)) == 3
+
+def test_random_accessions_with_gaps(simpleCohort):
+    simpleCohort.add_accession(Accession('GapSample'))
+    AID = simpleCohort._get_AID('GapSample')
+    del simpleCohort['GapSample']
+    AIDs = simpleCohort._sample_AIDs(200,replace=True,seed=1)
+    assert len(AIDs) == 200
+    assert AID not in AIDs
+
+def test_random_accessions_stratified(simpleCohort):
+    a = list(simpleCohort.random_accessions(n=2,stratify='type',seed=1))
+    assert sorted(x['type'] for x in a) == ['CHIP','CHIP','WGS','WGS']
+    with pytest.raises(ValueError):
+        simpleCohort.random_accessions(n=3,stratify='type')
+
 
 def test_from_accessions():
     a = Accession('Sample1',files=['file1.txt','file2.txt'],type='WGS')
@@ -70,3 +111,770 @@ def test_from_accessions():
     d = Accession('Sample4',files=['file1.txt','file2.txt'],type='CHIP')
     x = Cohort.from_accessions('TestCohort',[a,b,c,d])
 
+
+@pytest.mark.parametrize('query',[
+    'SELECT key, val FROM metadata WHERE AID = ?',
+    'SELECT AID FROM metadata WHERE key = ? AND val = ?',
+    'SELECT AID FROM aliases WHERE alias = ?',
+    'SELECT alias FROM aliases WHERE AID = ?',
+    'SELECT AID FROM aid_files WHERE FID = ?',
+    'SELECT url FROM files WHERE AID = ?',
+])
+def test_hot_queries_use_indexes(simpleCohort,query):
+    plan = [x[-1] for x in simpleCohort._db.cursor().execute(
+        f'EXPLAIN QUERY PLAN {query}',(1,)*query.count('?')
+    )]
+    assert not any(step.startswith('SCAN') for step in plan), plan
+
+def test_schema_upgrade(simpleCohort,monkeypatch):
+    simpleCohort._db.cursor().execute('''
+        DROP INDEX metadata_key_val;
+        DROP INDEX aliases_AID;
+        DROP INDEX aid_files_FID;
+    ''')
+    del simpleCohort._dict['schema_version']
+    pragmas = []
+    set_pragmas = Cohort._set_pragmas
+    def record(self,cur,values):
+        pragmas.append(dict(values))
+        return set_pragmas(self,cur,values)
+    monkeypatch.setattr(Cohort,'_set_pragmas',record)
+    x = Cohort(simpleCohort.name)
+    # Migrations are synced to disk
+    assert {'synchronous': 2} in pragmas
+    assert not any(p.get('synchronous') == 0 for p in pragmas)
+    assert x._dict['schema_version'] == Cohort._schema_version
+    indexes = [name for (name,) in x._db.cursor().execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"
+    )]
+    assert 'metadata_key_val' in indexes
+    assert 'aid_files_FID' in indexes
+
+def test_search_metadata_kwargs(simpleCohort):
+    x = simpleCohort.search_metadata(type='CHIP')
+    assert all([isinstance(a,Accession) for a in x])
+    assert set(a.name for a in x) == {'Sample3','Sample4'}
+
+def test_search_metadata_query(simpleCohort):
+    from minus80 import Query as Q
+    q = (Q('type') == 'WGS') | Q('type').startswith('CH')
+    assert len(simpleCohort.search_metadata(q,returns='AIDs')) == len(simpleCohort)
+    assert simpleCohort.search_metadata(~q,returns='names') == []
+    assert set(simpleCohort.search_metadata(
+        Q('type').isin(['WGS']),returns='names'
+    )) == {'Sample1','Sample2'}
+
+def test_search_metadata_numeric(simpleCohort):
+    from minus80 import Query as Q
+    a = Accession('NumericSample',age=25)
+    simpleCohort.add_accession(a)
+    assert simpleCohort.search_metadata(
+        Q('age').between(20,30),returns='names'
+    ) == ['NumericSample']
+    assert simpleCohort.search_metadata(Q('age') > 30,returns='names') == []
+    assert simpleCohort.search_metadata(Q('age') == '25',returns='names') == []
+    assert simpleCohort.search_metadata(Q('type') > 5,returns='names') == []
+    with pytest.raises(TypeError):
+        Q('age').between(20,'30')
+    assert [x.name for x in simpleCohort.search_metadata(
+        Q('age') >= 25,returns='iter',batch_size=1
+    )] == ['NumericSample']
+    del simpleCohort['NumericSample']
+
+def test_search_metadata_kwargs_match_text(simpleCohort):
+    simpleCohort.add_accession(
+        Accession('TextSample',age=25,alive=True,code='007')
+    )
+    assert simpleCohort.search_metadata(age='25',returns='names') == ['TextSample']
+    assert simpleCohort.search_metadata(age=25,returns='names') == ['TextSample']
+    assert simpleCohort.search_metadata(alive='True',returns='names') == ['TextSample']
+    assert simpleCohort.search_metadata(alive='1',returns='names') == []
+    assert simpleCohort.search_metadata(code='007',returns='names') == ['TextSample']
+    del simpleCohort['TextSample']
+
+def test_data_version_bumped(simpleCohort):
+    version = simpleCohort._data_version
+    a = Accession('VersionSample',type='WGS')
+    simpleCohort.add_accession(a)
+    assert simpleCohort._data_version > version
+    version = simpleCohort._data_version
+    del simpleCohort['VersionSample']
+    assert simpleCohort._data_version > version
+
+def test_as_DataFrame_cached(simpleCohort):
+    df = simpleCohort.as_DataFrame()
+    assert simpleCohort._dict['metadata_wide_version'] == simpleCohort._data_version
+    cached = simpleCohort.as_DataFrame(columns=['type'])
+    assert list(cached.columns) == ['type']
+    assert all(cached['type'] == df.loc[cached.index,'type'])
+
+def test_as_DataFrame_typed():
+    from minus80.Tools import delete
+    delete('Cohort','TypedFrameCohort',force=True)
+    x = Cohort('TypedFrameCohort')
+    x.add_accessions([Accession('S1',age=1),Accession('S2',age=2)])
+    assert str(x.as_DataFrame()['age'].dtype) == 'int64'
+    x.add_accessions([
+        Accession('S1',height=1.5,alive=True),
+        Accession('S2',height=2.0,alive=False),
+    ])
+    df = x.as_DataFrame()
+    assert str(df['age'].dtype) == 'int64'
+    assert str(df['height'].dtype) == 'float64'
+    assert str(df['alive'].dtype) == 'bool'
+    assert df.loc['S1','age'] == 1 and df.loc['S2','alive'] == False
+    delete('Cohort','TypedFrameCohort',force=True)
+
+def test_search_index_retried(simpleCohort):
+    # As left by a SQLite without FTS5 trigrams
+    for table in ('accessions','aliases','raw_files'):
+        simpleCohort._db.cursor().execute(f'''
+            DROP TRIGGER {table}_fts_insert;
+            DROP TRIGGER {table}_fts_delete;
+            DROP TRIGGER {table}_fts_update;
+            DROP TABLE {table}_fts;
+        ''')
+    simpleCohort._search_index = None
+    assert not simpleCohort._has_search_index
+    x = Cohort(simpleCohort.name)
+    assert x._has_search_index
+    assert x.search_accessions('ample1') == ['Sample1']
+    simpleCohort._search_index = None
+
+def test_search_accessions(simpleCohort):
+    assert simpleCohort._has_search_index
+    assert simpleCohort.search_accessions('ample1') == ['Sample1']
+    assert simpleCohort.search_accessions('SAMPLE2') == ['Sample2']
+    # too short for the trigram index
+    assert 'Sample3' in simpleCohort.search_accessions('e3')
+
+def test_search_index_in_sync(simpleCohort):
+    a = Accession('SearchableSample',files=['/tmp/searchable.fastq'])
+    simpleCohort.add_accession(a)
+    assert simpleCohort.search_accessions('Searchable') == ['SearchableSample']
+    assert simpleCohort.search_files('searchable.fastq') == ['/tmp/searchable.fastq']
+    del simpleCohort['SearchableSample']
+    assert simpleCohort.search_accessions('Searchable',recurse=False) == []
+
+def test_search_accessions_longest_common(RNACohort):
+    x = RNACohort.search_accessions(
+        'RNAAccession1_ATGTCA_L007_R1_001.fastq',include_scores=True
+    )
+    assert x[0] == ('RNAAccession1',100)
+    assert RNACohort.search_accessions('XXXX') == []
+
+def test_match_files(RNACohort):
+    files = [
+        '/data/RNAAccession1_ATGTCA_L007_R1_001.fastq',
+        '/data/rnaaccession2_L005_R2.fastq',
+        '/data/Unknown.fastq'
+    ]
+    x = RNACohort.match_files(files)
+    assert x[files[0]][0][0] == 'RNAAccession1'
+    assert x[files[1]][0][0] == 'RNAAccession2'
+    assert x[files[2]] == []
+    assert RNACohort.match_files(files,processes=2,chunksize=1) == x
+
+def test_assimilate_files(RNACohort):
+    x = RNACohort.assimilate_files([
+        '/data/RNAAccession1_ATGTCA_L007_R1_001.fastq',
+        '/data/Unknown.fastq'
+    ])
+    assert x['RNAAccession1'] == {'/data/RNAAccession1_ATGTCA_L007_R1_001.fastq'}
+    assert x['unmatched'] == {'/data/Unknown.fastq'}
+
+def test_AID_cache_is_per_instance(simpleCohort):
+    other = Cohort('OtherCohort')
+    simpleCohort._get_AID('Sample1')
+    assert 'Sample1' in simpleCohort._AID_cache
+    assert 'Sample1' not in other._AID_cache
+
+def test_AID_cache_targeted_invalidation(simpleCohort):
+    simpleCohort.add_accession(Accession('CacheSample',type='WGS'))
+    simpleCohort.preload_AIDs()
+    assert 'Sample1' in simpleCohort._AID_cache
+    assert 'CacheSample' in simpleCohort._AID_cache
+    del simpleCohort['CacheSample']
+    assert 'CacheSample' not in simpleCohort._AID_cache
+    assert 'CacheSample' not in simpleCohort
+    assert 'Sample1' in simpleCohort._AID_cache
+
+def test_AID_cache_eviction():
+    from minus80.Cohort import AIDCache
+    x = AIDCache(maxsize=2)
+    x['a'] = 1
+    x['b'] = 2
+    x.get('a')
+    x['c'] = 3
+    assert 'b' not in x
+    assert x.get('a') == 1
+    x.discard_AIDs([1])
+    assert len(x) == 1
+
+def test_add_accessions_generator(simpleCohort):
+    start_len = len(simpleCohort)
+    accessions = (Accession(f'ChunkSample{i}',type='chunk') for i in range(5))
+    assert simpleCohort.add_accessions(
+        accessions,chunksize=2,return_accessions=False
+    ) == 5
+    assert len(simpleCohort) == start_len + 5
+    added = simpleCohort.add_accessions(
+        [Accession('ChunkSample1',type='chunk',extra='yes')],chunksize=2
+    )
+    assert added[0].name == 'ChunkSample1'
+    assert added[0]['extra'] == 'yes'
+    for i in range(5):
+        del simpleCohort[f'ChunkSample{i}']
+
+def test_add_accessions_partial_failure_bumps_version(simpleCohort):
+    def accessions():
+        yield Accession('PartialSample1',type='WGS')
+        yield Accession('PartialSample2',type='WGS')
+        raise ValueError('bad input')
+    version = simpleCohort._data_version
+    with pytest.raises(ValueError):
+        simpleCohort.add_accessions(accessions(),chunksize=1)
+    assert 'PartialSample2' in simpleCohort
+    assert simpleCohort._data_version > version
+    for i in (1,2):
+        del simpleCohort[f'PartialSample{i}']
+
+def test_add_accessions_from_data_frame(simpleCohort):
+    import pandas as pd
+    import numpy as np
+    df = pd.DataFrame(
+        [['DFSample1',23,'O'],
+         ['DFSample2',np.nan,'O+'],
+         [None,30,'A']],
+        columns=['Name','Age','Type']
+    )
+    start_len = len(simpleCohort)
+    simpleCohort.add_accessions_from_data_frame(df,'Name')
+    assert len(simpleCohort) == start_len + 2
+    assert simpleCohort['DFSample1'].metadata['Type'] == 'O'
+    assert 'Age' in simpleCohort['DFSample1'].metadata
+    assert 'Age' not in simpleCohort['DFSample2'].metadata
+    with pytest.raises(ValueError):
+        simpleCohort.add_accessions_from_data_frame(df,'ERROR')
+    del simpleCohort['DFSample1']
+    del simpleCohort['DFSample2']
+
+def test_import_table(tmp_path):
+    from minus80.Tools import delete
+    sheet = tmp_path / 'sheet.csv'
+    sheet.write_text('Name,Age,Type\n001,23,O\n002,,O+\n003,30,A\n')
+    delete('Cohort','ImportCohort',force=True)
+    x = Cohort('ImportCohort')
+    assert x.import_table(str(sheet),'Name',chunksize=2) == 3
+    assert len(x) == 3
+    assert x['001']['Type'] == 'O'
+    assert 'Age' not in x['002'].metadata
+    assert x['001']['Age'] == 23 and isinstance(x['001']['Age'],int)
+    assert x['003']['Age'] == 30 and isinstance(x['003']['Age'],int)
+    delete('Cohort','ImportCohort',force=True)
+
+def test_import_table_types_do_not_depend_on_chunks(tmp_path):
+    from minus80.Tools import delete
+    sheet = tmp_path / 'sheet.csv'
+    sheet.write_text(
+        'Name,Age,Height,Code\nA,23,1.5,007\nB,,,008\n'
+        'C,30,2.0,9\nD,41,1.25,\n'
+    )
+    delete('Cohort','ImportCohort',force=True)
+    x = Cohort('ImportCohort')
+    x.import_table(str(sheet),'Name',chunksize=2)
+    assert [type(x[name]['Age']) for name in 'ACD'] == [int,int,int]
+    assert x['A']['Height'] == 1.5 and x['C']['Height'] == 2.0
+    assert x['A']['Code'] == '007' and x['C']['Code'] == 9
+    assert 'Age' not in x['B'].metadata
+    delete('Cohort','ImportCohort',force=True)
+
+def test_parse_text_column_matches_parse_text():
+    import pandas as pd
+    from minus80.Cohort import _parse_text,_parse_text_column,_stored_value
+    texts = [
+        '0','-0','007','23','-41','1.5','1.50','1e3','1e+20','inf','nan',
+        'True','False','true','+5','abc','1.0','2.5e-05',
+        '12345678901234567890','9007199254740993',
+    ]
+    parsed = _parse_text_column(pd.Series(texts + [None]))
+    assert pd.isnull(parsed.iloc[-1])
+    for text,val in zip(texts,parsed.tolist()):
+        expected = _stored_value(*_parse_text(text))
+        assert type(val) == type(expected) and val == expected, text
+    assert str(_parse_text_column(pd.Series(['1','2',None])).dtype) == 'Int64'
+    assert str(_parse_text_column(pd.Series(['1.5',None])).dtype) == 'Float64'
+    assert str(_parse_text_column(pd.Series(['True','False'])).dtype) == 'boolean'
+
+def test_import_parquet_types_do_not_depend_on_row_groups(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    from minus80.Tools import delete
+    sheet = str(tmp_path / 'sheet.parquet')
+    pq.write_table(pa.table({
+        'Name': ['A','B','C','D'],
+        'Age': [23,None,30,41],
+    }),sheet,row_group_size=2)
+    delete('Cohort','ImportCohort',force=True)
+    x = Cohort('ImportCohort')
+    assert x.import_table(sheet,'Name') == 4
+    assert [type(x[name]['Age']) for name in 'ACD'] == [int,int,int]
+    assert 'Age' not in x['B'].metadata
+    assert x._db.cursor().execute('''
+        SELECT GROUP_CONCAT(DISTINCT type) FROM metadata WHERE key = 'Age'
+    ''').fetchone()[0] == 'int'
+    delete('Cohort','ImportCohort',force=True)
+
+def test_add_accessions_upsert(simpleCohort):
+    simpleCohort.add_accessions([
+        Accession('UpsertSample1',files=['/tmp/u1.txt'],type='WGS',age=20),
+        Accession('UpsertSample2',type='WGS'),
+    ])
+    version = simpleCohort._data_version
+    summary = simpleCohort.add_accessions([
+        Accession('UpsertSample1',files=['/tmp/u1.txt'],type='WGS',age=20),
+        Accession('UpsertSample2',type='WGS'),
+    ],upsert=True)
+    assert summary['unchanged'] == 2
+    assert summary['updated'] == summary['added'] == 0
+    assert simpleCohort._data_version == version
+    summary = simpleCohort.add_accessions([
+        Accession('UpsertSample1',files=['/tmp/u2.txt'],type='CHIP'),
+        Accession('UpsertSample2',type='WGS'),
+        Accession('UpsertSample3',type='WGS'),
+    ],chunksize=2,upsert=True)
+    assert summary['added'] == 1
+    assert summary['updated'] == 1
+    assert summary['unchanged'] == 1
+    assert summary['metadata_removed'] == 2
+    assert summary['files_removed'] == summary['files_added'] == 1
+    assert simpleCohort._data_version > version
+    x = simpleCohort['UpsertSample1']
+    assert x.metadata == {'type': 'CHIP', 'AID': x['AID']}
+    assert x.files == {'/tmp/u2.txt'}
+    def accessions():
+        yield Accession('UpsertSample1',type='WGS')
+        raise ValueError('bad input')
+    version = simpleCohort._data_version
+    with pytest.raises(ValueError):
+        simpleCohort.add_accessions(accessions(),chunksize=1,upsert=True)
+    assert simpleCohort['UpsertSample1']['type'] == 'WGS'
+    assert simpleCohort._data_version > version
+    for i in range(1,4):
+        del simpleCohort[f'UpsertSample{i}']
+
+def test_add_accessions_upsert_duplicate_names(simpleCohort):
+    summary = simpleCohort.add_accessions([
+        Accession('UpsertDuplicate',files=['/tmp/d1.txt'],type='A'),
+        Accession('UpsertDuplicate',files=['/tmp/d2.txt'],type='B'),
+    ],upsert=True)
+    assert summary['added'] == 1
+    assert summary['metadata_added'] == summary['files_added'] == 1
+    x = simpleCohort['UpsertDuplicate']
+    assert x['type'] == 'B'
+    assert x.files == {'/tmp/d2.txt'}
+    del simpleCohort['UpsertDuplicate']
+
+def test_typed_metadata(simpleCohort):
+    simpleCohort.add_accession(
+        Accession('TypedSample',age=25,height=1.5,alive=True,code='007')
+    )
+    x = simpleCohort['TypedSample']
+    assert x['age'] == 25 and isinstance(x['age'],int)
+    assert x['height'] == 1.5
+    assert x['alive'] is True
+    assert x['code'] == '007'
+    del simpleCohort['TypedSample']
+
+def test_schema_upgrade_parses_text(simpleCohort):
+    cur = simpleCohort._db.cursor()
+    cur.execute('''
+        DROP INDEX metadata_key_val;
+        ALTER TABLE metadata RENAME TO metadata_v3;
+        CREATE TABLE metadata (
+            AID NOT NULL, key TEXT NOL NULL, val TEXT NOT NULL,
+            UNIQUE(AID, key, val)
+        );
+        INSERT INTO metadata SELECT AID, key, val FROM metadata_v3;
+        DROP TABLE metadata_v3;
+        INSERT INTO metadata VALUES (1, 'age', 25), (1, 'code', '007');
+    ''')
+    simpleCohort._dict['schema_version'] = 2
+    x = Cohort(simpleCohort.name)
+    assert x['Sample1']['age'] == 25
+    assert x['Sample1']['code'] == '007'
+    assert x['Sample1']['type'] == 'WGS'
+    x._db.cursor().execute(
+        "DELETE FROM metadata WHERE key IN ('age', 'code')"
+    )
+
+def test_schema_upgrade_merges_equal_numbers(simpleCohort):
+    cur = simpleCohort._db.cursor()
+    cur.execute('''
+        DROP INDEX metadata_key_val;
+        ALTER TABLE metadata RENAME TO metadata_v3;
+        CREATE TABLE metadata (
+            AID NOT NULL, key TEXT NOL NULL, val TEXT NOT NULL,
+            UNIQUE(AID, key, val)
+        );
+        INSERT INTO metadata SELECT AID, key, val FROM metadata_v3;
+        DROP TABLE metadata_v3;
+        INSERT INTO metadata VALUES
+            (1, 'age', '23'), (1, 'age', '23.0'),
+            (1, 'flag', '1'), (1, 'flag', '1.0');
+    ''')
+    simpleCohort._dict['schema_version'] = 2
+    x = Cohort(simpleCohort.name)
+    assert x['Sample1']['age'] == 23 and isinstance(x['Sample1']['age'],int)
+    assert x['Sample1']['flag'] == 1
+    assert x._db.cursor().execute(
+        "SELECT COUNT(*) FROM metadata WHERE key IN ('age', 'flag')"
+    ).fetchone()[0] == 2
+    x._db.cursor().execute(
+        "DELETE FROM metadata WHERE key IN ('age', 'flag')"
+    )
+
+def test_add_accessions_from_data_frame_typed(simpleCohort):
+    import pandas as pd
+    df = pd.DataFrame(
+        [['DFTyped1',23,1.5,True,'007'],
+         ['DFTyped2',30,None,False,7]],
+        columns=['Name','Age','Height','Flag','Code']
+    )
+    simpleCohort.add_accessions_from_data_frame(df,'Name')
+    x = simpleCohort['DFTyped1']
+    assert x['Age'] == 23 and isinstance(x['Age'],int)
+    assert x['Height'] == 1.5
+    assert x['Flag'] is True
+    assert x['Code'] == '007'
+    assert simpleCohort['DFTyped2']['Code'] == 7
+    del simpleCohort['DFTyped1']
+    del simpleCohort['DFTyped2']
+
+def test_enable_concurrency():
+    from concurrent.futures import ThreadPoolExecutor
+    from minus80.Tools import delete
+    delete('Cohort','ConcurrentCohort',force=True)
+    x = Cohort('ConcurrentCohort')
+    x.add_accessions([Accession(f'C{i}',type='WGS') for i in range(50)])
+    x.enable_concurrency(busy_timeout=1000,pool_size=2)
+    assert x._wal
+    def read(i):
+        return x[f'C{i % 50}']['type']
+    with ThreadPoolExecutor(8) as pool:
+        writer = pool.submit(
+            x.add_accessions,[Accession(f'D{i}') for i in range(50)]
+        )
+        assert set(pool.map(read,range(200))) == {'WGS'}
+        writer.result()
+    assert len(x) == 100
+    # Uncommitted changes are visible to reads in the same thread
+    with x._bulk_transaction() as cur:
+        cur.execute("INSERT INTO accessions (name) VALUES ('E1')")
+        assert 'E1' in x
+    # but not to reads in other threads
+    import threading
+    started, done = threading.Event(), threading.Event()
+    def write():
+        with x._bulk_transaction() as cur:
+            cur.execute("INSERT INTO accessions (name) VALUES ('E2')")
+            started.set()
+            done.wait(10)
+    writer = threading.Thread(target=write)
+    writer.start()
+    started.wait(10)
+    try:
+        assert 'E2' not in x.names
+        assert x.get_aliases('C1') == ['C1']
+        assert len(list(x.random_accessions(n=3,seed=1))) == 3
+    finally:
+        done.set()
+        writer.join()
+    assert 'E2' in x.names
+    assert Cohort('ConcurrentCohort')._wal
+    delete('Cohort','ConcurrentCohort',force=True)
+
+def test_alias_column(simpleCohort):
+    simpleCohort.add_accessions([
+        Accession('AliasSample1',lab='LAB-1',other='OTHER-1'),
+        Accession('AliasSample2',lab='LAB-2',other='LAB-1'),
+        Accession('AliasSample3',lab='L3',other='Sample1'),
+    ])
+    counts = simpleCohort.alias_column(['lab','other'])
+    assert counts['added'] == 2
+    assert counts['not_unique'] == 1
+    assert counts['too_short'] == 1
+    assert counts['name'] == 1
+    assert simpleCohort['OTHER-1'].name == 'AliasSample1'
+    assert simpleCohort['LAB-2'].name == 'AliasSample2'
+    assert 'LAB-1' not in simpleCohort
+    assert simpleCohort.alias_column(colname='lab')['existing'] == 1
+    simpleCohort.drop_aliases()
+    for i in range(1,4):
+        del simpleCohort[f'AliasSample{i}']
+
+def test_remove_accessions(simpleCohort):
+    from minus80 import Query as Q
+    simpleCohort.add_accessions([
+        Accession(f'RemoveSample{i}',files=[f'/tmp/remove{i}.txt','/tmp/shared.txt'],
+                  type='remove',lab=f'REMOVE-LAB-{i}')
+        for i in range(6)
+    ])
+    simpleCohort.alias_column('lab')
+    assert 'REMOVE-LAB-2' in simpleCohort
+    start_len = len(simpleCohort)
+    assert simpleCohort.remove_accessions(
+        ['RemoveSample0','RemoveSample1','NOT_A_SAMPLE']
+    ) == 2
+    assert 'RemoveSample0' not in simpleCohort
+    assert '/tmp/remove0.txt' in simpleCohort.raw_files
+    assert simpleCohort.remove_accessions(
+        Q('type') == 'remove',prune_files=True
+    ) == 4
+    assert len(simpleCohort) == start_len - 6
+    assert '/tmp/remove2.txt' not in simpleCohort.raw_files
+    assert '/tmp/shared.txt' not in simpleCohort.raw_files
+    assert 'REMOVE-LAB-2' not in simpleCohort
+    assert simpleCohort._db.cursor().execute(
+        "SELECT COUNT(*) FROM aliases WHERE alias LIKE 'REMOVE-LAB-%'"
+    ).fetchall() == [(0,)]
+
+def test_subset_copy_merge(simpleCohort):
+    from minus80 import Query as Q
+    from minus80.Tools import delete
+    for name in ('SubsetCohort','CopyCohort','MergeCohort'):
+        delete('Cohort',name,force=True)
+    x = simpleCohort.subset('SubsetCohort',Q('type') == 'WGS')
+    assert sorted(x.names) == ['Sample1','Sample2']
+    assert x['Sample1'].metadata['type'] == 'WGS'
+    assert x['Sample1'].files == simpleCohort['Sample1'].files
+    y = simpleCohort.copy('CopyCohort')
+    assert len(y) == len(simpleCohort)
+    assert sorted(y.raw_files) == sorted(simpleCohort.raw_files)
+    y.add_accession(Accession('Sample1',type='CHIP'))
+    y.remove_accessions(['Sample1'])
+    y.add_accession(Accession('Sample1',type='CHIP',files=['/tmp/merged.txt']))
+    z = Cohort.merge('MergeCohort',[x,y])
+    assert len(z) == len(simpleCohort)
+    assert z['Sample1']['type'] == 'CHIP'
+    assert '/tmp/merged.txt' in z['Sample1'].files
+    with pytest.raises(ValueError):
+        z._copy_from(z)
+    for name in ('SubsetCohort','CopyCohort','MergeCohort'):
+        delete('Cohort',name,force=True)
+
+@pytest.fixture
+def localSSH(monkeypatch):
+    # Run the remote commands of the SSHPool in a local shell
+    import asyncio
+    from minus80.SSHPool import SSHPool
+    import asyncssh
+    async def run_locally(self,hostname,command,username=None,input=None,check=False,**kwargs):
+        proc = await asyncio.create_subprocess_shell(
+            command,stdin=asyncio.subprocess.PIPE,stdout=asyncio.subprocess.PIPE
+        )
+        stdout,_ = await proc.communicate(input.encode())
+        if check and proc.returncode != 0:
+            raise asyncssh.ProcessError(
+                None,command,None,proc.returncode,None,proc.returncode,stdout.decode(),''
+            )
+        return type('Result',(),{'stdout':stdout.decode(),'exit_status':proc.returncode})
+    monkeypatch.setattr(SSHPool,'run',run_locally)
+
+def test_batch_fileinfo(simpleCohort,tmp_path,localSSH,monkeypatch):
+    import asyncio
+    import hashlib
+    raw = tmp_path / 'raw file.fastq'
+    raw.write_text('ACGT\n')
+    link = tmp_path / 'link.fastq'
+    link.symlink_to(raw)
+    urls = [f'ssh://user@localhost{x}' for x in (raw,link,tmp_path/'missing.fastq')]
+    for url in urls:
+        simpleCohort.add_raw_file(url)
+    raw_info,link_info,missing_info = asyncio.run(simpleCohort._batch_fileinfo(urls))
+    assert raw_info.md5 == hashlib.md5(b'ACGT\n').hexdigest()
+    assert raw_info.size == 5
+    assert link_info.canonical_path == str(raw)
+    assert link_info.md5 == raw_info.md5
+    assert missing_info.size is None and missing_info.md5 is None
+    pragmas = []
+    set_pragmas = simpleCohort._set_pragmas
+    def record(cur,values):
+        pragmas.append(dict(values))
+        return set_pragmas(cur,values)
+    monkeypatch.setattr(simpleCohort,'_set_pragmas',record)
+    stats = asyncio.run(simpleCohort._calculate_fileinfo(urls,progress=False))
+    assert pragmas[0] == {'synchronous': 2}
+    assert stats['user@localhost']['files'] == 3
+    assert simpleCohort.get_fileinfo(urls[0]).md5 == raw_info.md5
+    simpleCohort._db.cursor().executemany(
+        'DELETE FROM raw_files WHERE url = ?',[(url,) for url in urls]
+    )
+
+def test_batch_fileinfo_failed_command(simpleCohort,tmp_path,localSSH,monkeypatch):
+    import asyncio
+    import asyncssh
+    import importlib
+    CohortModule = importlib.import_module('minus80.Cohort')
+    raw = tmp_path / 'failed.fastq'
+    raw.write_text('ACGT\n')
+    url = f'ssh://user@localhost{raw}'
+    simpleCohort.add_raw_file(url)
+    asyncio.run(simpleCohort._calculate_fileinfo([url],progress=False))
+    info = simpleCohort.get_fileinfo(url)
+    # The command exits 127 without any output
+    monkeypatch.setattr(
+        CohortModule,'_fileinfo_command',lambda paths: ('exit 127','')
+    )
+    with pytest.raises(asyncssh.ProcessError):
+        asyncio.run(simpleCohort._batch_fileinfo([url],rehash=True))
+    # Output without a record for every file
+    monkeypatch.setattr(
+        CohortModule,'_fileinfo_command',lambda paths: ('true','')
+    )
+    with pytest.raises(IOError):
+        asyncio.run(simpleCohort._batch_fileinfo([url],rehash=True))
+    assert simpleCohort.get_fileinfo(url) == info
+    assert info.stale == 0
+    simpleCohort._db.cursor().execute('DELETE FROM raw_files WHERE url = ?',(url,))
+
+def test_failed_fileinfo_batches_are_retried(simpleCohort,tmp_path,localSSH,monkeypatch):
+    import asyncio
+    import hashlib
+    import importlib
+    CohortModule = importlib.import_module('minus80.Cohort')
+    raw = tmp_path / 'retried.fastq'
+    raw.write_text('ACGT\n')
+    url = f'ssh://user@localhost{raw}'
+    simpleCohort.add_raw_file(url)
+    fileinfo_command = CohortModule._fileinfo_command
+    calls = []
+    def fail_once(paths):
+        calls.append(paths)
+        if len(calls) == 1:
+            return 'exit 127',''
+        return fileinfo_command(paths)
+    monkeypatch.setattr(CohortModule,'_fileinfo_command',fail_once)
+    stats = asyncio.run(simpleCohort._calculate_fileinfo([url],progress=False))
+    assert len(calls) == 2
+    assert stats['user@localhost']['errors'] == 1
+    assert stats['user@localhost']['failed'] == 0
+    assert stats['user@localhost']['files'] == 1
+    info = simpleCohort.get_fileinfo(url)
+    assert info.md5 == hashlib.md5(b'ACGT\n').hexdigest()
+    assert info.stale == 0
+    simpleCohort._db.cursor().execute('DELETE FROM raw_files WHERE url = ?',(url,))
+
+def test_refresh_fileinfo(simpleCohort,tmp_path,localSSH):
+    import asyncio
+    import hashlib
+    raw = tmp_path / 'refresh.fastq'
+    raw.write_text('ACGT\n')
+    url = f'ssh://user@localhost{raw}'
+    simpleCohort.add_raw_file(url)
+    asyncio.run(simpleCohort._calculate_fileinfo([url],progress=False))
+    info = simpleCohort.get_fileinfo(url)
+    assert info.mtime is not None and info.inode is not None
+    summary = asyncio.run(simpleCohort.refresh_fileinfo([url],progress=False))
+    assert summary['changed'] == summary['stale'] == 0
+    raw.write_text('ACGTACGT\n')
+    summary = asyncio.run(simpleCohort.refresh_fileinfo(
+        [url],rehash=False,progress=False
+    ))
+    assert summary['stale'] == 1
+    assert simpleCohort.get_fileinfo(url).md5 == info.md5
+    summary = asyncio.run(simpleCohort.refresh_fileinfo([url],progress=False))
+    assert summary['changed'] == 1 and summary['stale'] == 0
+    info = simpleCohort.get_fileinfo(url)
+    assert info.md5 == hashlib.md5(b'ACGTACGT\n').hexdigest()
+    assert info.size == 9
+    # Touched but not changed, the md5 is the same
+    import os
+    os.utime(raw,(info.mtime + 10,info.mtime + 10))
+    summary = asyncio.run(simpleCohort.refresh_fileinfo([url],progress=False))
+    assert summary['changed'] == summary['stale'] == 0
+    # Stale until the stat matches the md5 again
+    os.utime(raw,(info.mtime + 20,info.mtime + 20))
+    asyncio.run(simpleCohort.refresh_fileinfo([url],rehash=False,progress=False))
+    assert simpleCohort.get_fileinfo(url).stale == 1
+    os.utime(raw,(info.mtime + 10,info.mtime + 10))
+    summary = asyncio.run(simpleCohort.refresh_fileinfo([url],rehash=False,progress=False))
+    assert summary['stale'] == 0
+    raw.unlink()
+    summary = asyncio.run(simpleCohort.refresh_fileinfo([url],progress=False))
+    assert summary['stale'] == 1 and summary['changed'] == 0
+    assert simpleCohort.get_fileinfo(url).md5 is None
+    simpleCohort._db.cursor().execute('DELETE FROM raw_files WHERE url = ?',(url,))
+
+def test_local_fileinfo(simpleCohort,tmp_path,monkeypatch):
+    import asyncio
+    import hashlib
+    from minus80.SSHPool import SSHPool
+    from minus80.Cohort import _is_local
+    async def no_ssh(*args,**kwargs):
+        raise AssertionError('local files should not use SSH')
+    monkeypatch.setattr(SSHPool,'run',no_ssh)
+    files = []
+    for i in range(4):
+        raw = tmp_path / f'local{i}.fastq'
+        raw.write_bytes(b'ACGT' * (i + 1) * 2**20)
+        files.append(raw)
+    simpleCohort.add_raw_file(str(files[0]),scheme='file')
+    for f in files[1:]:
+        simpleCohort.add_raw_file(str(f))
+    urls = [x for x in simpleCohort.raw_files if 'local' in x and str(tmp_path) in x]
+    assert len(urls) == 4 and all(_is_local(x) for x in urls)
+    assert not _is_local('ssh://someone@elsewhere/data/x.fastq')
+    asyncio.run(simpleCohort._calculate_fileinfo(
+        urls,local_threads=2,batch_size=2,progress=False
+    ))
+    for url,f in zip(sorted(urls),files):
+        info = simpleCohort.get_fileinfo(url)
+        assert info.md5 == hashlib.md5(f.read_bytes()).hexdigest()
+        assert info.size == f.stat().st_size
+        assert info.canonical_path == str(f)
+    simpleCohort._db.cursor().executemany(
+        'DELETE FROM raw_files WHERE url = ?',[(url,) for url in urls]
+    )
+
+def test_is_local_mixed_case_hostname(monkeypatch):
+    import socket
+    import getpass
+    from minus80.Cohort import _is_local, _local_hostnames
+    monkeypatch.setattr(socket,'gethostname',lambda: 'Lab-Server')
+    monkeypatch.setattr(socket,'getfqdn',lambda: 'Lab-Server.Example.org')
+    _local_hostnames.cache_clear()
+    try:
+        assert _is_local(f'ssh://{getpass.getuser()}@Lab-Server/data/x.fastq')
+        assert _is_local('ssh://lab-server.example.org/data/x.fastq')
+    finally:
+        monkeypatch.undo()
+        _local_hostnames.cache_clear()
+
+def test_local_fileinfo_failed_hash(simpleCohort,tmp_path,monkeypatch):
+    import asyncio
+    import importlib
+    CohortModule = importlib.import_module('minus80.Cohort')
+    raw = tmp_path / 'unhashable.fastq'
+    raw.write_text('ACGT\n')
+    simpleCohort.add_raw_file(str(raw),scheme='file')
+    url = [x for x in simpleCohort.raw_files if str(raw) in x][0]
+    monkeypatch.setattr(CohortModule,'_local_md5',lambda path: None)
+    asyncio.run(simpleCohort._calculate_fileinfo([url],progress=False))
+    info = simpleCohort.get_fileinfo(url)
+    assert info.md5 is None and info.stale == 1
+    simpleCohort._db.cursor().execute('DELETE FROM raw_files WHERE url = ?',(url,))
+
+def test_copy_keeps_source_journal_mode(simpleCohort):
+    from minus80.Tools import delete
+    for name in ('WALSourceCohort','WALCopyCohort'):
+        delete('Cohort',name,force=True)
+    source = simpleCohort.copy('WALSourceCohort')
+    source.enable_concurrency()
+    source.copy('WALCopyCohort')
+    assert source._db.cursor().execute(
+        'PRAGMA journal_mode'
+    ).fetchall() == [('wal',)]
+    assert Cohort('WALSourceCohort')._wal
+    for name in ('WALSourceCohort','WALCopyCohort'):
+        delete('Cohort',name,force=True)
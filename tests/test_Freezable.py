@@ -116,6 +116,54 @@ def test_bulk_transaction_rollback(simpleCohort):
                 (key, val, type) VALUES (?, ?, ?)''',
                 ('test_bulk', 2, 'int'))
 
+def test_bulk_transaction_restores_pragmas(simpleCohort):
+    cur = simpleCohort._db.cursor()
+    before = cur.execute('PRAGMA synchronous').fetchall()
+    with simpleCohort._bulk_transaction(profile='fast-unsafe') as cur:
+        assert cur.execute('PRAGMA synchronous').fetchall() == [(0,)]
+    assert cur.execute('PRAGMA synchronous').fetchall() == before
+    with pytest.raises(ValueError):
+        with simpleCohort._bulk_transaction(profile='ERROR'):
+            pass
+
+def test_bulk_transaction_failed_release(simpleCohort):
+    from minus80.Freezable import lite
+    # A reader holding a shared lock makes the commit busy
+    reader = lite.Connection(simpleCohort._get_dbpath('db.sqlite'))
+    reader_cur = reader.cursor()
+    reader_cur.execute('BEGIN')
+    reader_cur.execute('SELECT * FROM globals').fetchall()
+    simpleCohort._db.setbusytimeout(0)
+    try:
+        with pytest.raises(lite.BusyError):
+            with simpleCohort._bulk_transaction() as cur:
+                cur.execute(
+                    'INSERT OR REPLACE INTO globals (key, val, type) '
+                    'VALUES (?, ?, ?)', ('test_busy', 1, 'int')
+                )
+    finally:
+        reader_cur.execute('COMMIT')
+        reader.close()
+    assert simpleCohort._write_depth == 0
+    assert simpleCohort._writer is None
+    assert simpleCohort._db.getautocommit()
+    assert 'test_busy' not in simpleCohort._dict
+
+def test_group_commit(simpleCohort):
+    with pytest.raises(Exception):
+        with simpleCohort.group_commit(every=2):
+            for i in range(3):
+                with simpleCohort._bulk_transaction() as cur:
+                    cur.execute(
+                        'INSERT OR REPLACE INTO globals (key, val, type) '
+                        'VALUES (?, ?, ?)', (f'test_group{i}', i, 'int')
+                    )
+            raise ValueError('roll back the last batch')
+    # The first batch of two was committed
+    assert 'test_group1' in simpleCohort._dict
+    assert 'test_group2' not in simpleCohort._dict
+    assert simpleCohort._group_commit is None
+    assert simpleCohort._db.getautocommit()
 
 def test_child_dataset(simpleCohort):
     y = m80.Cohort("ChildCohort",parent=simpleCohort)
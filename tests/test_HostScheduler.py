@@ -0,0 +1,51 @@
+import asyncio
+
+from minus80.HostScheduler import HostScheduler
+
+
+def test_hosts_are_scheduled_independently():
+    running = {'fast': 0, 'slow': 0}
+    peak = {'fast': 0, 'slow': 0}
+    done = []
+    async def fn(items):
+        host = items[0][0]
+        running[host] += 1
+        peak[host] = max(peak[host], running[host])
+        await asyncio.sleep(0.05 if host == 'slow' else 0.001)
+        running[host] -= 1
+        done.extend(items)
+    batches = [('fast', [('fast', i)], 10) for i in range(40)] + \
+              [('slow', [('slow', i)], 10) for i in range(4)]
+    x = HostScheduler(max_tasks=6, max_per_host=4, progress=False)
+    stats = asyncio.run(x.run(batches, fn))
+    assert sorted(done) == sorted(b[1][0] for b in batches)
+    assert stats['fast']['files'] == 40
+    assert peak['fast'] <= 4 and peak['slow'] <= 4
+    assert peak['fast'] > 1
+
+
+def test_errors_are_retried_and_halve_the_limit():
+    calls = []
+    async def fn(items):
+        calls.append(items)
+        if items == ['bad'] or len(calls) == 1:
+            raise ConnectionError('dropped')
+    batches = [('host', ['good'], 0), ('host', ['bad'], 0)]
+    x = HostScheduler(max_retries=2, backoff=0, progress=False)
+    stats = asyncio.run(x.run(batches, fn))
+    assert calls.count(['good']) == 2
+    assert calls.count(['bad']) == 3
+    assert stats['host']['files'] == 1
+    assert stats['host']['failed'] == 1
+    assert stats['host']['errors'] == 4
+
+
+def test_rates_are_compared_in_the_same_unit():
+    from minus80.HostScheduler import _Lane
+    x = _Lane('host', max_limit=4)
+    x.succeeded(1, 2**30, 1)
+    x.succeeded(500, 0, 1)
+    x.succeeded(500, 0, 1)
+    assert x.limit == 4
+    x.succeeded(1, 2**20, 1)
+    assert x.limit == 3
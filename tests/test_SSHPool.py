@@ -0,0 +1,90 @@
+import asyncio
+import asyncssh
+import pytest
+
+from minus80.SSHPool import SSHPool
+
+
+class FakeConnection(object):
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.closed = False
+
+    async def run(self, command, **kwargs):
+        if command == 'false':
+            raise asyncssh.ProcessError(
+                None, command, None, 1, None, None, '', ''
+            )
+        if self.fail:
+            self.fail -= 1
+            raise asyncssh.DisconnectError(11, 'dropped')
+        await asyncio.sleep(0.01)
+        return command
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+@pytest.fixture
+def fakePool(monkeypatch):
+    pool = SSHPool(max_connections=2)
+    pool.opened = []
+    async def connect(hostname, username):
+        pool.opened.append(FakeConnection())
+        return pool.opened[-1]
+    monkeypatch.setattr(pool, '_connect', connect)
+    return pool
+
+
+def test_connections_are_bounded_and_reused(fakePool):
+    async def run_all():
+        results = await asyncio.gather(*[
+            fakePool.run('host', f'echo {i}', username='user')
+            for i in range(10)
+        ])
+        await fakePool.run('other', 'echo', username='user')
+        assert len(fakePool) == 3
+        return results
+    results = asyncio.run(run_all())
+    assert results == [f'echo {i}' for i in range(10)]
+    assert len(fakePool.opened) == 3
+
+
+def test_reconnect_on_disconnect(fakePool):
+    async def run_twice():
+        await asyncio.gather(*[
+            fakePool.run('host', 'echo', username='user') for _ in range(2)
+        ])
+        fakePool.opened[1].fail = 1
+        result = await fakePool.run('host', 'echo', username='user')
+        # The dropped connection and the other idle one are closed
+        assert fakePool.opened[0].closed and fakePool.opened[1].closed
+        assert len(fakePool) == 1
+        return result
+    assert asyncio.run(run_twice()) == 'echo'
+    assert len(fakePool.opened) == 3
+
+
+def test_command_errors_keep_the_connection(fakePool):
+    async def fail_then_run():
+        with pytest.raises(asyncssh.ProcessError):
+            await fakePool.run('host', 'false', check=True)
+        result = await fakePool.run('host', 'echo')
+        assert not fakePool.opened[0].closed
+        return result
+    assert asyncio.run(fail_then_run()) == 'echo'
+    assert len(fakePool.opened) == 1
+
+
+def test_connections_are_closed_with_their_loop(fakePool):
+    async def run():
+        return await fakePool.run('host', 'echo', username='user')
+    assert asyncio.run(run()) == 'echo'
+    assert fakePool.opened[0].closed
+    assert len(fakePool) == 0
+    assert asyncio.run(run()) == 'echo'
+    assert len(fakePool.opened) == 2
+    assert fakePool.opened[1].closed
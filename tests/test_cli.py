@@ -56,3 +56,17 @@ def test_cli_cloud_delete(simpleCohort):
 
 
 
+def test_cli_cohort_import(tmp_path):
+    sheet = tmp_path / 'sheet.tsv'
+    sheet.write_text('Name\tAge\tType\nS1\t23\tO\nS2\t30\tO+\n')
+    m80.Tools.delete('Cohort','cli_import',force=True)
+    runner=CliRunner()
+    result = runner.invoke(
+        cli.cohort.commands['import'],
+        ['cli_import',str(sheet),'--name-col','Name','--chunksize','1']
+    )
+    assert result.exit_code == 0
+    x = m80.Cohort('cli_import')
+    assert len(x) == 2
+    assert x['S2']['Type'] == 'O+'
+    m80.Tools.delete('Cohort','cli_import',force=True)